@@ -1,91 +1,227 @@
 """
 Configuration module for ESP32 Device Controller
-Handles environment variables with proper formatting using python-decouple
+Handles environment variables with proper formatting; .env is parsed by python-decouple
 """
 
-from decouple import config
-from typing import List, Optional
+from __future__ import annotations
 
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional
 
+from decouple import RepositoryEnv
+
+
+# Read .env a single time up front and overlay the process environment on top
+# (same precedence as decouple); every field below is then a plain dict lookup
+_ENV_FILE   = Path(__file__).resolve().parent / ".env"
+# Same spellings decouple accepts; anything else is a configuration error
+_TRUTHY     = frozenset({"1", "true", "yes", "on", "y", "t"})
+_FALSY      = frozenset({"0", "false", "no", "off", "n", "f", ""})
+
+
+def _read_environment() -> Dict[str, str]:
+    values = dict(RepositoryEnv(_ENV_FILE).data) if _ENV_FILE.is_file() else {}
+    values.update(os.environ)
+    return values
+
+
+_ENV = _read_environment()
+
+
+def _env(key: str, default: Optional[str] = None) -> Optional[str]:
+    return _ENV.get(key, default)
+
+
+def _env_int(key: str, default: int) -> int:
+    value = _ENV.get(key)
+    return default if value is None else int(value)
+
+
+def _env_bool(key: str, default: bool) -> bool:
+    value = _ENV.get(key)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in _TRUTHY:
+        return True
+    if value in _FALSY:
+        return False
+    raise ValueError(f"Invalid boolean value for {key}: {value!r}")
+
+
+# Comma-separated integer IDs; whitespace and empty entries are tolerated
+_ALLOWED_USERS_FORMAT   = re.compile(r"[\s,]*(?:-?\d+\s*(?:,[\s,]*|$))*")
+_USER_ID                = re.compile(r"-?\d+")
+
+
+# Linux cpulist syntax, e.g. "2" or "0-1,4"
+_CPU_LIST_FORMAT        = re.compile(r"\s*\d+(?:-\d+)?\s*(?:,\s*\d+(?:-\d+)?\s*)*")
+
+
+def _parse_cpu_list(cpus_str: str) -> FrozenSet[int]:
+    """Parse a cpulist such as APP_CPU_AFFINITY into a set of CPU indexes"""
+    if not cpus_str or not cpus_str.strip():
+        return frozenset()
+    if _CPU_LIST_FORMAT.fullmatch(cpus_str) is None:
+        raise ValueError(f"Invalid APP_CPU_AFFINITY format: {cpus_str!r}")
+    cpus = set()
+    for part in cpus_str.split(","):
+        first, _, last = part.strip().partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return frozenset(cpus)
+
+
+def _parse_allowed_users(users_str: str) -> List[int]:
+    """
+    Parse comma-separated user IDs from environment variable
+    Tokenizing is done by the regex engine instead of per-token strip()/int()
+    """
+    if not users_str:
+        return []
+    if _ALLOWED_USERS_FORMAT.fullmatch(users_str) is None:
+        raise ValueError(f"Invalid TELEGRAM_ALLOWED_USERS format: {users_str!r}")
+    return list(map(int, _USER_ID.findall(users_str)))
+
+
+@dataclass(frozen=True, slots=True)
 class Settings:
     """Application settings loaded from environment variables"""
     
     # MQTT Configuration with proper alignment
-    MQTT_BROKER_HOST        : str = config("MQTT_BROKER_HOST", default="localhost")
-    MQTT_BROKER_PORT        : int = config("MQTT_BROKER_PORT", default=1883, cast=int)
-    MQTT_USERNAME           : Optional[str] = config("MQTT_USERNAME", default=None)
-    MQTT_PASSWORD           : Optional[str] = config("MQTT_PASSWORD", default=None)
+    MQTT_BROKER_HOST        : str
+    MQTT_BROKER_PORT        : int
+    MQTT_USERNAME           : Optional[str]
+    MQTT_PASSWORD           : Optional[str] = field(repr=False)
+    MQTT_PUBLISH_TIMEOUT_SECONDS : int
+    MQTT_WILDCARD_SUBSCRIBE : bool
+    MQTT_RELAY_QOS          : int
     
     # Connection Pool Settings
-    MQTT_POOL_SIZE          : int = config("MQTT_POOL_SIZE", default=10, cast=int)
-    MQTT_MAX_OVERFLOW       : int = config("MQTT_MAX_OVERFLOW", default=5, cast=int)
-    MQTT_POOL_TIMEOUT       : int = config("MQTT_POOL_TIMEOUT", default=10, cast=int)
-    MQTT_POOL_RECYCLE       : int = config("MQTT_POOL_RECYCLE", default=1800, cast=int)
+    MQTT_POOL_SIZE          : int
+    MQTT_MAX_OVERFLOW       : int
+    MQTT_POOL_TIMEOUT       : int
+    MQTT_POOL_RECYCLE       : int
     
     # Telegram Bot Configuration
-    TELEGRAM_BOT_TOKEN      : Optional[str] = config("TELEGRAM_BOT_TOKEN", default=None)
-    TELEGRAM_ALLOWED_USERS  : str = config("TELEGRAM_ALLOWED_USERS", default="")
+    TELEGRAM_BOT_TOKEN      : Optional[str] = field(repr=False)
+    TELEGRAM_ALLOWED_USERS  : str
+    TELEGRAM_POLL_TIMEOUT   : int
+    TELEGRAM_CONCURRENCY    : int
+    TELEGRAM_HTTP2          : bool
+    TELEGRAM_WEBHOOK_URL    : str
+    TELEGRAM_WEBHOOK_SECRET : Optional[str] = field(repr=False)
     
     # Application Settings
-    APP_HOST                : str = config("APP_HOST", default="0.0.0.0")
-    APP_PORT                : int = config("APP_PORT", default=8000, cast=int)
-    APP_RELOAD              : bool = config("APP_RELOAD", default=True, cast=bool)
+    APP_HOST                : str
+    APP_PORT                : int
+    APP_RELOAD              : bool
+    APP_WORKERS             : int
+    APP_CPU_AFFINITY        : str
     
     # Logging Configuration
-    LOG_LEVEL               : str = config("LOG_LEVEL", default="INFO")
-    LOG_FORMAT              : str = config(
-        "LOG_FORMAT"
-        , default="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
+    LOG_LEVEL               : str
+    LOG_FORMAT              : str
+    LOG_MAX_BYTES           : int
+    LOG_BACKUP_COUNT        : int
     
     # Device Configuration
-    CONFIG_FILE_PATH        : str = config("CONFIG_FILE_PATH", default="esp_config.json")
+    CONFIG_FILE_PATH        : str
+    CONFIG_DB_PATH          : Optional[str]
+    CONFIG_SAVE_DEBOUNCE_MS : int
+    CONFIG_SAVE_MAX_PENDING : int
+    CONFIG_JOURNAL_MAX_BYTES : int
+    CONFIG_JSON_INDENT      : bool
+    CONFIG_HEARTBEAT_PERSIST_SECONDS : int
     
     # Device Timeout Configuration
-    DEVICE_HEARTBEAT_TIMEOUT_SECONDS : int = config("DEVICE_HEARTBEAT_TIMEOUT_SECONDS", default=90, cast=int)
-    DEVICE_STATUS_TIMEOUT_SECONDS    : int = config("DEVICE_STATUS_TIMEOUT_SECONDS", default=120, cast=int)
-    DEVICE_MONITOR_INTERVAL_SECONDS  : int = config("DEVICE_MONITOR_INTERVAL_SECONDS", default=30, cast=int)
+    DEVICE_HEARTBEAT_TIMEOUT_SECONDS : int
+    DEVICE_STATUS_TIMEOUT_SECONDS    : int
+    DEVICE_MONITOR_INTERVAL_SECONDS  : int
     
-    @classmethod
-    def get_telegram_allowed_users(cls) -> List[int]:
-        """
-        Parse comma-separated user IDs from environment variable
-        Maintains proper formatting and error handling
-        """
-        users_str = cls.TELEGRAM_ALLOWED_USERS
-        if users_str:
-            try:
-                return [
-                    int(user_id.strip()) 
-                    for user_id in users_str.split(",")
-                    if user_id.strip()
-                ]
-            except ValueError as e:
-                raise ValueError(f"Invalid TELEGRAM_ALLOWED_USERS format: {e}")
-        return []
+    # Computed in __post_init__ - the environment does not change for the process lifetime
+    _ALLOWED_USERS_LIST     : List[int]         = field(init=False, repr=False)
+    _ALLOWED_USERS          : FrozenSet[int]    = field(init=False, repr=False)
+    LOG_LEVEL_INT           : int               = field(init=False)
+    APP_CPUS                : FrozenSet[int]    = field(init=False)
+    
+    def __post_init__(self):
+        allowed_users = _parse_allowed_users(self.TELEGRAM_ALLOWED_USERS)
+        object.__setattr__(self, "_ALLOWED_USERS_LIST", allowed_users)
+        object.__setattr__(self, "_ALLOWED_USERS", frozenset(allowed_users))
+        
+        log_level = logging.getLevelName(self.LOG_LEVEL.upper())
+        object.__setattr__(self, "LOG_LEVEL_INT", log_level if isinstance(log_level, int) else logging.INFO)
+        object.__setattr__(self, "APP_CPUS", _parse_cpu_list(self.APP_CPU_AFFINITY))
     
-    @classmethod
-    def validate_required_settings(cls) -> bool:
+    def get_telegram_allowed_users(self) -> List[int]:
+        """Return the allowed user IDs parsed from TELEGRAM_ALLOWED_USERS"""
+        return self._ALLOWED_USERS_LIST
+    
+    def validate_required_settings(self) -> bool:
         """
         Validate that required environment variables are set
         Returns True if all required settings are valid
         """
-        required_settings = []
-        
-        # Add validation for critical settings
-        if not cls.MQTT_BROKER_HOST:
-            required_settings.append("MQTT_BROKER_HOST")
+        if not self.MQTT_BROKER_HOST:
+            raise ValueError("Missing required environment variables: MQTT_BROKER_HOST")
         
-        if cls.TELEGRAM_BOT_TOKEN and not cls.get_telegram_allowed_users():
-            required_settings.append("TELEGRAM_ALLOWED_USERS (when bot token is set)")
-        
-        if required_settings:
+        if self.TELEGRAM_BOT_TOKEN and not self._ALLOWED_USERS:
             raise ValueError(
-                f"Missing required environment variables: {', '.join(required_settings)}"
+                "Missing required environment variables: TELEGRAM_ALLOWED_USERS (when bot token is set)"
             )
         
         return True
 
 
+def _load_settings() -> Settings:
+    """Read every setting from the environment in a single pass"""
+    return Settings(
+        MQTT_BROKER_HOST                    = _env("MQTT_BROKER_HOST", "localhost")
+        , MQTT_BROKER_PORT                  = _env_int("MQTT_BROKER_PORT", 1883)
+        , MQTT_USERNAME                     = _env("MQTT_USERNAME")
+        , MQTT_PASSWORD                     = _env("MQTT_PASSWORD")
+        , MQTT_PUBLISH_TIMEOUT_SECONDS      = _env_int("MQTT_PUBLISH_TIMEOUT_SECONDS", 2)
+        , MQTT_WILDCARD_SUBSCRIBE           = _env_bool("MQTT_WILDCARD_SUBSCRIBE", True)
+        , MQTT_RELAY_QOS                    = _env_int("MQTT_RELAY_QOS", 1)
+        , MQTT_POOL_SIZE                    = _env_int("MQTT_POOL_SIZE", 10)
+        , MQTT_MAX_OVERFLOW                 = _env_int("MQTT_MAX_OVERFLOW", 5)
+        , MQTT_POOL_TIMEOUT                 = _env_int("MQTT_POOL_TIMEOUT", 10)
+        , MQTT_POOL_RECYCLE                 = _env_int("MQTT_POOL_RECYCLE", 1800)
+        , TELEGRAM_BOT_TOKEN                = _env("TELEGRAM_BOT_TOKEN")
+        , TELEGRAM_ALLOWED_USERS            = _env("TELEGRAM_ALLOWED_USERS", "")
+        , TELEGRAM_POLL_TIMEOUT             = _env_int("TELEGRAM_POLL_TIMEOUT", 30)
+        , TELEGRAM_CONCURRENCY              = max(1, _env_int("TELEGRAM_CONCURRENCY", 16))
+        , TELEGRAM_HTTP2                    = _env_bool("TELEGRAM_HTTP2", True)
+        , TELEGRAM_WEBHOOK_URL              = _env("TELEGRAM_WEBHOOK_URL", "")
+        , TELEGRAM_WEBHOOK_SECRET           = _env("TELEGRAM_WEBHOOK_SECRET")
+        , APP_HOST                          = _env("APP_HOST", "0.0.0.0")
+        , APP_PORT                          = _env_int("APP_PORT", 8000)
+        , APP_RELOAD                        = _env_bool("APP_RELOAD", True)
+        , APP_WORKERS                       = _env_int("APP_WORKERS", 1)
+        , APP_CPU_AFFINITY                  = _env("APP_CPU_AFFINITY", "")
+        , LOG_LEVEL                         = _env("LOG_LEVEL", "INFO")
+        , LOG_FORMAT                        = _env(
+            "LOG_FORMAT"
+            , default="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        )
+        , LOG_MAX_BYTES                     = _env_int("LOG_MAX_BYTES", 64 * 1024 * 1024)
+        , LOG_BACKUP_COUNT                  = _env_int("LOG_BACKUP_COUNT", 5)
+        , CONFIG_FILE_PATH                  = _env("CONFIG_FILE_PATH", "esp_config.json")
+        , CONFIG_DB_PATH                    = _env("CONFIG_DB_PATH")
+        , CONFIG_SAVE_DEBOUNCE_MS           = _env_int("CONFIG_SAVE_DEBOUNCE_MS", 250)
+        , CONFIG_SAVE_MAX_PENDING           = _env_int("CONFIG_SAVE_MAX_PENDING", 5)
+        , CONFIG_JOURNAL_MAX_BYTES          = _env_int("CONFIG_JOURNAL_MAX_BYTES", 0)
+        , CONFIG_JSON_INDENT                = _env_bool("CONFIG_JSON_INDENT", False)
+        , CONFIG_HEARTBEAT_PERSIST_SECONDS  = _env_int("CONFIG_HEARTBEAT_PERSIST_SECONDS", 30)
+        , DEVICE_HEARTBEAT_TIMEOUT_SECONDS  = _env_int("DEVICE_HEARTBEAT_TIMEOUT_SECONDS", 90)
+        , DEVICE_STATUS_TIMEOUT_SECONDS     = _env_int("DEVICE_STATUS_TIMEOUT_SECONDS", 120)
+        , DEVICE_MONITOR_INTERVAL_SECONDS   = _env_int("DEVICE_MONITOR_INTERVAL_SECONDS", 30)
+    )
+
+
 # Global settings instance
-settings = Settings() 
\ No newline at end of file
+settings = _load_settings()
@@ -1,106 +1,218 @@
+import atexit
 import logging
 import logging.handlers
+import queue
 import sys
+import threading
+import time
 from pathlib import Path
-from datetime import datetime
 
 from config import settings
 
-class CustomFormatter(logging.Formatter):
-    COLORS = {
-        'DEBUG'     : '\033[36m',
-        'INFO'      : '\033[32m',
-        'WARNING'   : '\033[33m',
-        'ERROR'     : '\033[31m',
-        'CRITICAL'  : '\033[35m',
-    }
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter that renders the timestamp once per wall-clock second"""
+    
+    default_msec_format = None
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._time_cache = (None, '')
+    
+    def formatTime(self, record, datefmt=None):
+        second, formatted = self._time_cache
+        if int(record.created) != second:
+            formatted           = time.strftime(datefmt or self.default_time_format, self.converter(record.created))
+            self._time_cache    = (int(record.created), formatted)
+        return formatted
+
+class ColorFormatter(CachedTimeFormatter):
+    """Console formatter that wraps the level and logger name in ANSI colors"""
+    
+    # Indexed by levelno // 10: NOTSET, DEBUG, INFO, WARNING, ERROR, CRITICAL
+    LEVEL_COLORS = (
+        '',
+        '\033[36m',
+        '\033[32m',
+        '\033[33m',
+        '\033[31m',
+        '\033[35m',
+    )
     RESET = '\033[0m'
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Seeded with the standard level names; logger names are added as they appear
+        self._colored = {}
+        for index in range(1, len(self.LEVEL_COLORS)):
+            self._colorize(index, logging.getLevelName(index * 10))
+    
+    def _colorize(self, index: int, text: str) -> str:
+        key     = (index, text)
+        colored = self._colored.get(key)
+        if colored is None:
+            colored = self._colored[key] = f"{self.LEVEL_COLORS[index]}{text}{self.RESET}"
+        return colored
+    
     def format(self, record):
-        if hasattr(record, 'color') and record.color:
-            log_color           = self.COLORS.get(record.levelname, '')
-            record.levelname    = f"{log_color}{record.levelname}{self.RESET}"
-            record.name         = f"{log_color}{record.name}{self.RESET}"
-        
-        return super().format(record)
+        levelname, name     = record.levelname, record.name
+        index               = min(record.levelno // 10, 5)
+        record.levelname    = self._colorize(index, levelname)
+        record.name         = self._colorize(index, name)
+        try:
+            return super().format(record)
+        finally:
+            # The same record goes on to the file handler, keep it uncolored
+            record.levelname, record.name = levelname, name
+
+class LazyRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that creates its directory on the first write"""
+    
+    def __init__(self, filename, **kwargs):
+        kwargs["delay"] = True
+        super().__init__(filename, **kwargs)
+    
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
+# Application loggers resolved once; get_logger() serves repeat lookups from here
+loggers = {
+    'main'      : logging.getLogger('esp.main'),
+    'config'    : logging.getLogger('esp.config'),
+    'mqtt'      : logging.getLogger('esp.mqtt'),
+    'telegram'  : logging.getLogger('esp.telegram'),
+    'api'       : logging.getLogger('esp.api'),
+}
+_main_logger = loggers['main']
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+QUIET_LOGGERS = ('httpx', 'telegram', 'paho', 'urllib3')
+
+FILE_BUFFER_CAPACITY        = 512
+FILE_FLUSH_INTERVAL_SECONDS = 30
+
+def _flush_periodically(handler: logging.Handler, interval: float):
+    """Flush a buffering handler every `interval` seconds so quiet periods still reach disk"""
+    def tick():
+        # A closed MemoryHandler drops its target; stop ticking for handlers that were replaced
+        if handler.target is None:
+            return
+        handler.flush()
+        _flush_periodically(handler, interval)
+    
+    timer           = threading.Timer(interval, tick)
+    timer.daemon    = True
+    timer.start()
+
+# (listener, buffered file handler) installed by the last setup_logging() call
+_installed = None
 
 def setup_logging():
-    log_dir     = Path("logs")
-    log_dir.mkdir(exist_ok=True)
+    """Install the logging pipeline, or keep the one already installed if it is still open
+    
+    logging.config.dictConfig (uvicorn.run applies its LOGGING_CONFIG) closes every existing
+    handler, so a call after that rebuilds the pipeline instead of keeping a dead one.
+    """
+    global _installed
+    if _installed is not None:
+        listener, buffered_file_handler = _installed
+        if buffered_file_handler.target is not None:
+            return loggers
+        # Closed underneath us: retire the old listener thread before building a new one
+        atexit.unregister(listener.stop)
+        listener.stop()
+    
+    # None of the formats use thread/process/task fields; skip collecting them per record
+    logging.logThreads          = False
+    logging.logProcesses        = False
+    logging.logMultiprocessing  = False
+    logging.logAsyncioTasks     = False
     
-    log_level   = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
+    log_dir     = Path("logs")
     
+    # Handlers stay at NOTSET and inherit the single root level
     logger      = logging.getLogger()
-    logger.setLevel(log_level)
+    logger.setLevel(settings.LOG_LEVEL_INT)
     
     logger.handlers.clear()
     
-    console_handler     = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
-    console_formatter   = CustomFormatter(
+    console_formatter   = ColorFormatter(
         fmt     = '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt = '%Y-%m-%d %H:%M:%S'
+        datefmt = DATE_FORMAT
     )
     
-    class ColoredStreamHandler(logging.StreamHandler):
-        def emit(self, record):
-            record.color = True
-            super().emit(record)
-    
-    console_handler = ColoredStreamHandler(sys.stdout)
-    console_handler.setLevel(log_level)
+    console_handler     = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(console_formatter)
-    logger.addHandler(console_handler)
     
-    file_handler = logging.handlers.RotatingFileHandler(
+    file_handler = LazyRotatingFileHandler(
         filename    = log_dir / "app.log",
-        maxBytes    = 10 * 1024 * 1024,
-        backupCount = 5,
+        maxBytes    = settings.LOG_MAX_BYTES,
+        backupCount = settings.LOG_BACKUP_COUNT,
         encoding    = 'utf-8'
     )
-    file_handler.setLevel(log_level)
-    file_formatter = logging.Formatter(
+    file_formatter = CachedTimeFormatter(
         fmt     = '%(asctime)s - %(name)s - %(levelname)s - %(funcName)s:%(lineno)d - %(message)s',
-        datefmt = '%Y-%m-%d %H:%M:%S'
+        datefmt = DATE_FORMAT
     )
     file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
-
-    logging.getLogger('httpx').setLevel(logging.WARNING)
-    logging.getLogger('telegram').setLevel(logging.WARNING)
-    logging.getLogger('paho').setLevel(logging.WARNING)
-    logging.getLogger('urllib3').setLevel(logging.WARNING)
     
-    loggers = {
-        'main'      : logging.getLogger('esp.main'),
-        'config'    : logging.getLogger('esp.config'),
-        'mqtt'      : logging.getLogger('esp.mqtt'),
-        'telegram'  : logging.getLogger('esp.telegram'),
-        'api'       : logging.getLogger('esp.api'),
-    }
+    # Accumulate records in memory and write them out in batches; errors flush immediately
+    buffered_file_handler = logging.handlers.MemoryHandler(
+        capacity        = FILE_BUFFER_CAPACITY,
+        flushLevel      = logging.ERROR,
+        target          = file_handler,
+        flushOnClose    = True
+    )
+    atexit.register(buffered_file_handler.flush)
+    _flush_periodically(buffered_file_handler, FILE_FLUSH_INTERVAL_SECONDS)
+    
+    # Callers only enqueue records; formatting and I/O run on the listener thread
+    log_queue   = queue.SimpleQueue()
+    listener    = logging.handlers.QueueListener(
+        log_queue,
+        console_handler,
+        buffered_file_handler,
+        respect_handler_level = True
+    )
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+    _installed = (listener, buffered_file_handler)
+
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
     
     return loggers
 
 def get_logger(name: str) -> logging.Logger:
-    return logging.getLogger(f'esp.{name}')
+    logger = loggers.get(name)
+    if logger is None:
+        logger = loggers[name] = logging.getLogger(f'esp.{name}')
+    return logger
+
+BANNER_RULE = "=" * 60
+
+# Settings are frozen, so the whole startup banner can be rendered once
+STARTUP_BANNER = "\n".join([
+    BANNER_RULE,
+    "ESP32 Device Controller Starting Up",
+    BANNER_RULE,
+    f"Log Level: {settings.LOG_LEVEL}",
+    f"App Host: {settings.APP_HOST}:{settings.APP_PORT}",
+    f"MQTT Broker: {settings.MQTT_BROKER_HOST}:{settings.MQTT_BROKER_PORT}",
+    f"Config File: {settings.CONFIG_FILE_PATH}",
+    f"Reload Mode: {settings.APP_RELOAD}",
+    BANNER_RULE,
+])
 
 def log_startup_info():
-    logger = get_logger('main')
-    
-    logger.info("=" * 60)
-    logger.info("ESP32 Device Controller Starting Up")
-    logger.info("=" * 60)
-    logger.info(f"Log Level: {settings.LOG_LEVEL}")
-    logger.info(f"App Host: {settings.APP_HOST}:{settings.APP_PORT}")
-    logger.info(f"MQTT Broker: {settings.MQTT_BROKER_HOST}:{settings.MQTT_BROKER_PORT}")
-    logger.info(f"Config File: {settings.CONFIG_FILE_PATH}")
-    logger.info(f"Reload Mode: {settings.APP_RELOAD}")
-    logger.info("=" * 60)
+    _main_logger.info(STARTUP_BANNER)
 
 def log_shutdown_info():
-    logger = get_logger('main')
-    
-    logger.info("=" * 60)
-    logger.info("ESP32 Device Controller Shutting Down")
-    logger.info(f"Shutdown Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    logger.info("=" * 60) 
\ No newline at end of file
+    _main_logger.info("\n".join([
+        BANNER_RULE,
+        "ESP32 Device Controller Shutting Down",
+        f"Shutdown Time: {time.strftime(DATE_FORMAT)}",
+        BANNER_RULE,
+    ]))
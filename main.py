@@ -1,9 +1,14 @@
 import uvicorn
 import asyncio
+import os
+import secrets
+import sys
+from typing import List
 from contextlib import asynccontextmanager
 
+import orjson
 from fastapi import HTTPException, status, Depends, Request, Response, FastAPI
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import Response, JSONResponse, ORJSONResponse
 
 from config import settings
 from models import Device, DeviceControl, DevicesResponse, DeviceStatus, RelayState
@@ -13,25 +18,26 @@ from telegram_bot import TelegramBot
 from logger import setup_logging, get_logger, log_startup_info, log_shutdown_info
 
 setup_logging()
-logger = get_logger('main')
+logger      = get_logger('main')
+api_logger  = get_logger('api')
 
-config_manager  = ConfigManager()
-mqtt_client     = MQTTClient(config_manager=config_manager)
-telegram_bot    = TelegramBot(config_manager=config_manager, mqtt_client=mqtt_client)
+ROOT_RESPONSE_BODY = orjson.dumps({"message": "ESP32 Device Controller API", "status": "running"})
 
 # Background task control
 background_task_running = False
 
-def get_config_manager() -> ConfigManager:
-    return config_manager
+# Services are built per worker in lifespan and live on app.state.
+# Providers are async so FastAPI resolves them inline instead of via the threadpool.
+async def get_config_manager(request: Request) -> ConfigManager:
+    return request.app.state.config_manager
 
-def get_mqtt_client() -> MQTTClient:
-    return mqtt_client
+async def get_mqtt_client(request: Request) -> MQTTClient:
+    return request.app.state.mqtt_client
 
-def get_telegram_bot() -> TelegramBot:
-    return telegram_bot
+async def get_telegram_bot(request: Request) -> TelegramBot:
+    return request.app.state.telegram_bot
 
-async def device_timeout_monitor():
+async def device_timeout_monitor(config_manager: ConfigManager, telegram_bot: TelegramBot):
     """Background task to monitor device timeouts and update status"""
     global background_task_running
     monitor_logger              = get_logger('device_monitor')
@@ -42,22 +48,29 @@ async def device_timeout_monitor():
             timeout_updates     = config_manager.check_device_timeouts()
             
             if timeout_updates:
-                monitor_logger.info(f"Timeout monitor: Updated {len(timeout_updates)} devices")
+                monitor_logger.info("Timeout monitor: Updated %s devices", len(timeout_updates))
+                notifications = []
                 for device_id, new_status in timeout_updates.items():
-                    monitor_logger.warning(f"Device {device_id} marked as {new_status.value} due to timeout")
+                    monitor_logger.warning("Device %s marked as %s due to timeout", device_id, new_status.value)
+                    notifications.append(f"⚠️ Device {device_id} has been marked as {new_status.value} due to timeout")
                 
-                    if telegram_bot.application and telegram_bot.allowed_users:
-                        try:
-                            message = f"⚠️ Device {device_id} has been marked as {new_status.value} due to timeout"
-                            for chat_id in telegram_bot.allowed_users:
-                                await telegram_bot.application.bot.send_message(chat_id=chat_id, text=message)
-                        except Exception as e:
-                            monitor_logger.error(f"Failed to send timeout notification: {e}")
+                if telegram_bot.application and telegram_bot.allowed_users:
+                    # Overlap the Telegram round-trips instead of awaiting them one by one
+                    send    = telegram_bot.application.bot.send_message
+                    targets = [(chat_id, message) for chat_id in telegram_bot.notify_chat_ids for message in notifications]
+                    results = await asyncio.gather(
+                        *(send(chat_id=chat_id, text=message) for chat_id, message in targets)
+                        , return_exceptions=True
+                    )
+                    for (chat_id, _), result in zip(targets, results):
+                        if isinstance(result, Exception):
+                            monitor_logger.error("Failed to send timeout notification to %s: %s", chat_id, result)
             
-            await asyncio.sleep(settings.DEVICE_MONITOR_INTERVAL_SECONDS)
+            # Sleep until a device can actually time out; the interval is only an upper bound
+            await config_manager.wait_for_next_deadline(settings.DEVICE_MONITOR_INTERVAL_SECONDS)
             
         except Exception as e:
-            monitor_logger.error(f"Error in device timeout monitor: {e}")
+            monitor_logger.error("Error in device timeout monitor: %s", e)
             await asyncio.sleep(60) 
 
 @asynccontextmanager
@@ -65,20 +78,33 @@ async def lifespan(app: FastAPI):
     global background_task_running
     log_startup_info()
 
-    try:
-        await mqtt_client.connect()
+    config_manager  = ConfigManager()
+    mqtt_client     = MQTTClient(config_manager=config_manager)
+    telegram_bot    = TelegramBot(config_manager=config_manager, mqtt_client=mqtt_client)
+    
+    app.state.config_manager    = config_manager
+    app.state.mqtt_client       = mqtt_client
+    app.state.telegram_bot      = telegram_bot
+
+    # Overlap the broker handshake with Telegram's getMe; one failing must not cancel the other
+    mqtt_result, telegram_result = await asyncio.gather(
+        mqtt_client.connect()
+        , telegram_bot.start()
+        , return_exceptions = True
+    )
+    
+    if isinstance(mqtt_result, Exception):
+        logger.error("Failed to initialize MQTT: %s", mqtt_result)
+    else:
         logger.info("MQTT client initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize MQTT: {e}")
     
-    try:
-        await telegram_bot.start()
+    if isinstance(telegram_result, Exception):
+        logger.error("Failed to start Telegram bot: %s", telegram_result)
+    else:
         logger.info("Telegram bot started successfully")
-    except Exception as e:
-        logger.error(f"Failed to start Telegram bot: {e}")
     
     background_task_running = True
-    monitor_task            = asyncio.create_task(device_timeout_monitor())
+    monitor_task            = asyncio.create_task(device_timeout_monitor(config_manager, telegram_bot))
     logger.info("Device timeout monitor started")
     
     yield
@@ -95,42 +121,44 @@ async def lifespan(app: FastAPI):
     
     await mqtt_client.disconnect()
     await telegram_bot.stop()
+    await config_manager.flush_async()
+    config_manager.close()
 
 app = FastAPI(
     title           = "ESP32 Device Controller"
     , description   = "FastAPI MQTT publisher for controlling ESP32 devices"
     , version       = "1.0.0"
     , lifespan      = lifespan
+    , default_response_class = ORJSONResponse
     , docs_url      = None
     , redoc_url     = None
 )
 
 @app.get("/", tags=["Health"])
 async def root():
-    api_logger = get_logger('api')
-    api_logger.info("Root endpoint accessed")
-    return {"message": "ESP32 Device Controller API", "status": "running"}
+    api_logger.debug("Root endpoint accessed")
+    return Response(content=ROOT_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/devices", response_model=DevicesResponse, tags=["Devices"])
 async def get_devices(config: ConfigManager = Depends(get_config_manager)):
-    api_logger = get_logger('api')
-    api_logger.info("Getting all devices")
-    return DevicesResponse(devices=list(config.devices_db.values()))
+    api_logger.debug("Getting all devices")
+    # Pre-encoded body matching DevicesResponse; skips validation and re-encoding per request
+    return Response(content=config.devices_json(), media_type="application/json")
 
 @app.get("/devices/{device_id}", response_model=Device, tags=["Devices"])
 async def get_device(
     device_id   : str
     , config    : ConfigManager = Depends(get_config_manager)
 ):
-    api_logger = get_logger('api')
-    api_logger.info(f"Getting device: {device_id}")
+    api_logger.debug("Getting device: %s", device_id)
     
-    device = config.get_device(device_id)
-    if not device:
-        api_logger.warning(f"Device not found: {device_id}")
+    body = config.device_json(device_id)
+    if body is None:
+        api_logger.warning("Device not found: %s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
     
-    return device
+    # Cached encoded fragment; skips response_model re-validation
+    return Response(body, media_type="application/json")
 
 @app.get("/devices/{device_id}/connection", tags=["Devices", "Diagnostics"])
 async def get_device_connection_info(
@@ -138,12 +166,11 @@ async def get_device_connection_info(
     , config: ConfigManager = Depends(get_config_manager)
 ):
     """Get detailed connection information for a device including timestamps and timeout status"""
-    api_logger      = get_logger('api')
-    api_logger.info(f"Getting connection info for device: {device_id}")
+    api_logger.debug("Getting connection info for device: %s", device_id)
     
     connection_info = config.get_device_connection_info(device_id)
     if "error" in connection_info:
-        api_logger.warning(f"Device not found: {device_id}")
+        api_logger.warning("Device not found: %s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
     
     return connection_info
@@ -154,15 +181,14 @@ async def get_devices_by_status(
     , config: ConfigManager = Depends(get_config_manager)
 ):
     """Get all devices with a specific status"""
-    api_logger = get_logger('api')
-    api_logger.info(f"Getting devices with status: {status.value}")
+    api_logger.debug("Getting devices with status: %s", status.value)
     
     devices = config.get_devices_by_status(status)
-    return {
+    return ORJSONResponse({
         "status": status.value,
         "count": len(devices),
-        "devices": list(devices.values())
-    }
+        "devices": config.dump_devices(devices)
+    })
 
 @app.get("/devices/diagnostics/stale", tags=["Devices", "Diagnostics"])
 async def get_stale_devices(
@@ -170,20 +196,18 @@ async def get_stale_devices(
     , config: ConfigManager = Depends(get_config_manager)
 ):
     """Get devices that haven't been seen within the threshold (default: heartbeat timeout)"""
-    api_logger = get_logger('api')
-    api_logger.info(f"Getting stale devices with threshold: {threshold_seconds}")
+    api_logger.debug("Getting stale devices with threshold: %s", threshold_seconds)
     
     stale_devices = config.get_stale_devices(threshold_seconds)
-    return {
+    return ORJSONResponse({
         "threshold_seconds": threshold_seconds or config.heartbeat_timeout_seconds,
         "stale_count": len(stale_devices),
-        "devices": list(stale_devices.values())
-    }
+        "devices": config.dump_devices(stale_devices)
+    })
 
 @app.post("/devices/diagnostics/check-timeouts", tags=["Devices", "Diagnostics"])
 async def manual_timeout_check(config: ConfigManager = Depends(get_config_manager)):
     """Manually trigger a device timeout check"""
-    api_logger = get_logger('api')
     api_logger.info("Manual timeout check requested")
     
     timeout_updates = config.check_device_timeouts()
@@ -200,20 +224,19 @@ async def control_device_relay(
     , config    : ConfigManager = Depends(get_config_manager)
     , mqtt      : MQTTClient    = Depends(get_mqtt_client)
 ):
-    api_logger  = get_logger('api')
-    api_logger.info(f"Controlling device {device_id} - setting relay to {control.relay_state}")
+    api_logger.info("Controlling device %s - setting relay to %s", device_id, control.relay_state)
     
     device      = config.get_device(device_id)
     if not device:
-        api_logger.warning(f"Device not found: {device_id}")
+        api_logger.warning("Device not found: %s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
     
     if device.status == DeviceStatus.disconnected:
-        api_logger.warning(f"Device {device_id} is disconnected")
+        api_logger.warning("Device %s is disconnected", device_id)
         raise HTTPException(status_code=400, detail="Device is disconnected")
     
     try:
-        mqtt.publish_relay_control(device_id, control.relay_state)
+        await mqtt.publish_relay_control(device_id, control.relay_state)
         
         return {
             "message": f"Relay command sent to {device_id}"
@@ -222,20 +245,58 @@ async def control_device_relay(
             , "status": "success"
         }
         
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Broker did not acknowledge the command")
     except Exception as e:
-        api_logger.error(f"Failed to control device {device_id}: {e}")
+        api_logger.error("Failed to control device %s: %s", device_id, e)
         raise HTTPException(status_code=500, detail="Failed to send command to device")
 
+@app.post("/devices/control:batch", tags=["Control"])
+async def control_device_relays(
+    controls    : List[DeviceControl]
+    , config    : ConfigManager = Depends(get_config_manager)
+    , mqtt      : MQTTClient    = Depends(get_mqtt_client)
+):
+    api_logger.info("Controlling %s devices in one batch", len(controls))
+    
+    if not controls:
+        raise HTTPException(status_code=400, detail="No commands given")
+    
+    for control in controls:
+        device  = config.get_device(control.device)
+        if not device:
+            api_logger.warning("Device not found: %s", control.device)
+            raise HTTPException(status_code=404, detail=f"Device not found: {control.device}")
+        
+        if device.status == DeviceStatus.disconnected:
+            api_logger.warning("Device %s is disconnected", control.device)
+            raise HTTPException(status_code=400, detail=f"Device is disconnected: {control.device}")
+    
+    try:
+        devices = await mqtt.publish_many([(control.device, control.relay_state) for control in controls])
+        
+        return {
+            "message": f"Relay commands sent to {len(devices)} devices"
+            , "devices": devices
+            , "status": "success"
+        }
+        
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Broker did not acknowledge every command")
+    except Exception as e:
+        api_logger.error("Failed to control devices in batch: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to send commands to devices")
+
 @app.post("/devices", response_model=Device, tags=["Devices"])
 async def add_device(
     device  : Device
     , config: ConfigManager = Depends(get_config_manager)
     , mqtt  : MQTTClient = Depends(get_mqtt_client)
 ):
-    logger.info(f"Adding new device: {device.device}")
+    logger.info("Adding new device: %s", device.device)
     
     if config.get_device(device.device):
-        logger.warning(f"Device already exists: {device.device}")
+        logger.warning("Device already exists: %s", device.device)
         raise HTTPException(status_code=400, detail="Device already exists")
     
     config.add_device(device)
@@ -243,7 +304,8 @@ async def add_device(
     if mqtt.is_connected:
         mqtt.subscribe_device(device.device)
     
-    return device
+    # The body was validated on the way in; echo it without a second response_model pass
+    return Response(config.device_json(device.device), media_type="application/json")
 
 @app.delete("/devices/{device_id}", tags=["Devices"])
 async def remove_device(
@@ -251,10 +313,10 @@ async def remove_device(
     , config    : ConfigManager = Depends(get_config_manager)
     , mqtt      : MQTTClient = Depends(get_mqtt_client)
 ):
-    logger.info(f"Removing device: {device_id}")
+    logger.info("Removing device: %s", device_id)
     
     if not config.get_device(device_id):
-        logger.warning(f"Device not found: {device_id}")
+        logger.warning("Device not found: %s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
     
     if mqtt.is_connected:
@@ -269,13 +331,13 @@ async def reload_config(config: ConfigManager = Depends(get_config_manager)):
     logger.info("Reloading configuration from file")
     
     try:
-        config.load_config()
+        await config.load_config_async()
         return {
             "message": "Configuration reloaded successfully"
-            , "devices_count": len(config.devices_db)
+            , "devices_count": len(config.devices_view)
         }
     except Exception as e:
-        logger.error(f"Failed to reload config: {e}")
+        logger.error("Failed to reload config: %s", e)
         raise HTTPException(status_code=500, detail="Failed to reload configuration")
 
 @app.post("/subscribe/{device_id}", tags=["MQTT"])
@@ -284,11 +346,11 @@ async def subscribe_to_device(
     , config    : ConfigManager = Depends(get_config_manager)
     , mqtt      : MQTTClient    = Depends(get_mqtt_client)
 ):
-    logger.info(f"Subscribing to MQTT topics for device: {device_id}")
+    logger.info("Subscribing to MQTT topics for device: %s", device_id)
     
     device = config.get_device(device_id)
     if not device:
-        logger.warning(f"Device not found: {device_id}")
+        logger.warning("Device not found: %s", device_id)
         raise HTTPException(status_code=404, detail="Device not found")
     
     if not mqtt.is_connected:
@@ -306,12 +368,12 @@ async def subscribe_to_device(
             raise HTTPException(status_code=500, detail="Failed to subscribe to some topics")
         
     except Exception as e:
-        logger.error(f"Failed to subscribe to MQTT topics: {e}")
+        logger.error("Failed to subscribe to MQTT topics: %s", e)
         raise HTTPException(status_code=500, detail="Failed to subscribe to MQTT topics")
 
 @app.get("/mqtt/status", tags=["MQTT"])
 async def get_mqtt_status(mqtt: MQTTClient = Depends(get_mqtt_client)):
-    return mqtt.get_connection_status()
+    return Response(content=mqtt.connection_status_json(), media_type="application/json")
 
 @app.post("/telegram/test_send", tags=["Telegram"])
 async def test_telegram_send(
@@ -321,25 +383,38 @@ async def test_telegram_send(
     if not bot.application:
         raise HTTPException(status_code=500, detail="Telegram bot not running")
     
-    if not bot.allowed_users:
+    if bot.primary_chat_id is None:
         raise HTTPException(status_code=400, detail="No allowed users configured")
     
     try:
-        chat_id = bot.allowed_users[0]
+        chat_id = bot.primary_chat_id
         await bot.application.bot.send_message(chat_id=chat_id, text=f"🤖 {message}")
         return {"message": f"Test message sent to user {chat_id}"}
     except Exception as e:
-        logger.error(f"Failed to send test message: {e}")
+        logger.error("Failed to send test message: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
 
 @app.get("/telegram/status", tags=["Telegram"])
 async def telegram_status(bot: TelegramBot = Depends(get_telegram_bot)):
-    is_running = bot.application is not None
-    return {
-        "telegram_bot_running": is_running
-        , "bot_token_configured": bot.bot_token is not None
-        , "allowed_users_count": len(bot.allowed_users)
-    }
+    return Response(content=bot.status_json(), media_type="application/json")
+
+@app.post("/telegram/webhook", tags=["Telegram"], include_in_schema=False)
+async def telegram_webhook(request: Request, bot: TelegramBot = Depends(get_telegram_bot)):
+    if not bot.application or not settings.TELEGRAM_WEBHOOK_URL:
+        raise HTTPException(status_code=404, detail="Telegram webhook not enabled")
+    
+    # Compared as bytes: compare_digest rejects non-ASCII str, and header values are arbitrary
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+    if not secrets.compare_digest(token, bot.webhook_secret.encode()):
+        raise HTTPException(status_code=403, detail="Invalid webhook secret")
+    
+    try:
+        # orjson.JSONDecodeError is a ValueError as well
+        await bot.process_webhook_update(orjson.loads(await request.body()))
+    except ValueError as e:
+        api_logger.warning("Rejected malformed Telegram webhook update: %s", e)
+        raise HTTPException(status_code=400, detail="Malformed update")
+    return Response(status_code=200)
 
 @app.post("/telegram/send_message", tags=["Telegram"])
 async def send_telegram_message(
@@ -354,13 +429,33 @@ async def send_telegram_message(
         await bot.application.bot.send_message(chat_id=chat_id, text=message)
         return {"message": "Message sent successfully"}
     except Exception as e:
-        logger.error(f"Failed to send Telegram message: {e}")
+        logger.error("Failed to send Telegram message: %s", e)
         raise HTTPException(status_code=500, detail="Failed to send message")
 
 if __name__ == "__main__":
+    workers = settings.APP_WORKERS
+    if workers > 1:
+        # Every worker runs its own lifespan with a private device registry, MQTT client and
+        # timeout monitor over the same config file; nothing keeps them in sync yet. Telegram
+        # also allows only one getUpdates poller per token
+        logger.warning("APP_WORKERS > 1 is not supported yet (workers do not share device state) - running a single worker")
+        workers = 1
+    
+    if settings.APP_CPUS:
+        if hasattr(os, "sched_setaffinity"):
+            # Keep the event loop from migrating between cores; workers and the reloader inherit it
+            os.sched_setaffinity(0, settings.APP_CPUS)
+            logger.info("Pinned to CPUs %s", sorted(settings.APP_CPUS))
+        else:
+            logger.warning("APP_CPU_AFFINITY is not supported on this platform - ignoring it")
+    
     uvicorn.run(
         "main:app"
         , reload    = settings.APP_RELOAD
         , host      = settings.APP_HOST
         , port      = settings.APP_PORT
+        , workers   = workers
+        , loop      = "asyncio" if sys.platform == "win32" else "uvloop"
+        , http      = "httptools"
+        , lifespan  = "on"
     )
\ No newline at end of file
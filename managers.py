@@ -1,55 +1,219 @@
-import json
+import asyncio
+import atexit
+import errno
+import hashlib
+import heapq
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, Optional
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Set, Tuple
 from datetime import datetime, timedelta
 
+import orjson
+from pydantic import TypeAdapter
+
 from config import settings
 from models import Device, DeviceStatus, RelayState
 from logger import get_logger
 
 logger = get_logger('config')
 
+DEVICE_COLUMNS  = ("device", "status", "relay_state", "mqtt_topic", "last_seen", "last_heartbeat")
+
+CREATE_DEVICES_TABLE = (
+    "CREATE TABLE IF NOT EXISTS devices ("
+    "device TEXT PRIMARY KEY, status TEXT NOT NULL, relay_state TEXT NOT NULL, "
+    "mqtt_topic TEXT NOT NULL, last_seen TEXT, last_heartbeat TEXT)"
+)
+SELECT_DEVICES  = f"SELECT {', '.join(DEVICE_COLUMNS)} FROM devices"
+UPSERT_DEVICE   = (
+    f"INSERT INTO devices ({', '.join(DEVICE_COLUMNS)}) "
+    f"VALUES ({', '.join(':' + column for column in DEVICE_COLUMNS)}) "
+    f"ON CONFLICT(device) DO UPDATE SET "
+    f"{', '.join(f'{column}=excluded.{column}' for column in DEVICE_COLUMNS[1:])}"
+)
+DELETE_DEVICE   = "DELETE FROM devices WHERE device = ?"
+
+# Validates/dumps a whole device list in one pydantic-core call
+DEVICE_LIST_ADAPTER = TypeAdapter(List[Device])
+
 class ConfigManager:
     def __init__(self, config_file: str = None):
         self.config_file    = Path(config_file or settings.CONFIG_FILE_PATH)
         self.devices_db     : Dict[str, Device] = {}
+        # Read-only live view for callers outside the manager; devices_db is never rebound
+        self.devices_view   : Mapping[str, Device] = MappingProxyType(self.devices_db)
+        # JSON-ready dumps per device, dropped whenever the device changes
+        self._dumped        : Dict[str, dict]   = {}
+        # orjson-encoded dumps per device, joined into the /devices body
+        self._encoded       : Dict[str, bytes]  = {}
+        # Encoded /devices body, rebuilt on the first read after any change
+        self._devices_json  : Optional[bytes]   = None
+        # status -> device ids (dict as an insertion-ordered set), kept in step by _invalidate
+        self._by_status     : Dict[DeviceStatus, Dict[str, None]] = {status: {} for status in DeviceStatus}
+        # device_id -> 1-based registry position, rebuilt only after a device is added or removed
+        self._positions     : Optional[Dict[str, int]] = None
+        # Bumped on every device change so callers can key their own render caches on it
+        self.version        = 0
         # Device status timeout configuration from settings
         self.heartbeat_timeout_seconds = settings.DEVICE_HEARTBEAT_TIMEOUT_SECONDS
         self.status_timeout_seconds = settings.DEVICE_STATUS_TIMEOUT_SECONDS
+        
+        # Min-heap of (deadline, device_id) for connected devices; entries not matching
+        # _deadline_of are stale and skipped lazily
+        self._deadlines             : List[Tuple[float, str]] = []
+        self._deadline_of           : Dict[str, float] = {}
+        # (last_heartbeat, last_seen) as epoch floats for the same devices - the sweep compares these
+        self._epoch_of              : Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self._deadline_wake         = asyncio.Event()
+        
+        # Coalesced persistence - mutations mark the config dirty and one write covers the burst
+        self.save_debounce_seconds  = settings.CONFIG_SAVE_DEBOUNCE_MS / 1000
+        self.save_max_pending       = settings.CONFIG_SAVE_MAX_PENDING
+        # Keep-alive heartbeats with no status change only need to reach disk this often
+        self.heartbeat_persist_seconds = settings.CONFIG_HEARTBEAT_PERSIST_SECONDS
+        self._dirty                 = False
+        self._pending_updates       = 0
+        self._flush_handle          : Optional[asyncio.TimerHandle] = None
+        self._flush_task            : Optional[asyncio.Task]        = None
+        self._flush_lock            = asyncio.Lock()
+        # Dedicated writer thread - saves never queue behind other to_thread work
+        self._save_executor         = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-save")
+        
+        # Optional SQLite store - writes only the rows that changed instead of the whole file
+        self.db_path                = settings.CONFIG_DB_PATH
+        self._db                    : Optional[sqlite3.Connection] = self._open_db() if self.db_path else None
+        self._changed               : Set[str] = set()
+        
+        # Optional append-only journal for the JSON store, compacted into the file past the limit
+        self.journal_file           = self.config_file.with_name(self.config_file.name + ".journal")
+        self.journal_max_bytes      = settings.CONFIG_JOURNAL_MAX_BYTES
+        self._journal_size          = 0
+        self.json_indent            = settings.CONFIG_JSON_INDENT
+        # Digest of the last full write; identical rewrites are skipped
+        self._written_digest        : Optional[bytes] = None
+        # Cleared once the config directory turns out not to accept a temp file
+        self._atomic_writes         = True
         self.load_config()
+        # Last-chance write for exits that skip the lifespan shutdown (signals, sys.exit in a script)
+        atexit.register(self.flush)
 
     def load_config(self):
         try:
-            if self.config_file.exists():
-                with open(self.config_file, 'r') as f:
-                    config_data = json.load(f)
-
-                if "devices" in config_data:
-                    devices_list = config_data["devices"]
-                elif isinstance(config_data, list):
-                    devices_list = config_data
-                else:
-                    devices_list = [config_data]
-                
-                for device_data in devices_list:
-                    
-                    if 'last_seen' not in device_data:
-                        device_data['last_seen'] = None
-                    if 'last_heartbeat' not in device_data:
-                        device_data['last_heartbeat'] = None
-                    
-                    device = Device(**device_data)
-                    self.devices_db[device.device] = device
-
-                logger.info(f"Loaded {len(self.devices_db)} devices from {self.config_file}")
-            else:
-                self.create_default_config()
-                logger.info("Created default config")
+            self._apply_config(self._read_config())
+        except Exception as e:
+            logger.error("Error loading config: %s", e)
+            self.create_default_config()
 
+    async def load_config_async(self):
+        """load_config with the file read and parse run off the event loop"""
+        if self._db is not None:
+            # Indexed table read; the connection stays on the loop thread
+            self.load_config()
+            return
+        
+        try:
+            self._apply_config(await asyncio.to_thread(self._read_config))
         except Exception as e:
-            logger.error(f"Error loading config: {e}")
+            logger.error("Error loading config: %s", e)
             self.create_default_config()
 
+    def _open_db(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(CREATE_DEVICES_TABLE)
+        logger.info("Using SQLite device store at %s", self.db_path)
+        return db
+
+    def _read_config(self) -> Optional[list]:
+        if self._db is not None:
+            return self._read_db()
+        return self._read_json()
+
+    def _read_db(self) -> Optional[list]:
+        """Read the device rows, importing the JSON config on first use"""
+        devices_list = [dict(zip(DEVICE_COLUMNS, row)) for row in self._db.execute(SELECT_DEVICES)]
+        if devices_list:
+            return devices_list
+        
+        devices_list = self._read_json()
+        if devices_list is None:
+            return None
+        
+        devices = DEVICE_LIST_ADAPTER.validate_python(devices_list)
+        self._write_rows([device.to_json_dict() for device in devices], [])
+        try:
+            os.replace(self.config_file, self.config_file.with_name(self.config_file.name + ".bak"))
+        except OSError as e:
+            # Bind-mounted file - it is simply ignored from now on
+            logger.warning("Imported %s but could not rename it - %s", self.config_file, e)
+        logger.info("Imported %s devices from %s into %s", len(devices_list), self.config_file, self.db_path)
+        return devices_list
+
+    def _read_json(self) -> Optional[list]:
+        """Read the device list from disk, None if the file does not exist"""
+        if not self.config_file.exists():
+            return None
+        
+        with open(self.config_file, 'rb') as f:
+            config_data = orjson.loads(f.read())
+
+        if "devices" in config_data:
+            devices_list = config_data["devices"]
+        elif isinstance(config_data, list):
+            devices_list = config_data
+        else:
+            devices_list = [config_data]
+        
+        return self._replay_journal(devices_list)
+
+    def _replay_journal(self, devices_list: list) -> list:
+        """Apply journal entries written since the last compaction"""
+        if not self.journal_file.exists():
+            self._journal_size = 0
+            return devices_list
+        
+        with open(self.journal_file, 'rb') as f:
+            journal = f.read()
+        self._journal_size = len(journal)
+        
+        devices = {device_data["device"]: device_data for device_data in devices_list}
+        for line in journal.splitlines():
+            try:
+                entry = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Torn final append from a crash - everything before it is intact
+                logger.warning("Skipping unreadable entry in %s", self.journal_file)
+                continue
+            
+            if entry["op"] == "upsert":
+                devices[entry["device"]["device"]] = entry["device"]
+            else:
+                devices.pop(entry["device"], None)
+        
+        return list(devices.values())
+
+    def _apply_config(self, devices_list: Optional[list]):
+        if devices_list is None:
+            self.create_default_config()
+            logger.info("Created default config")
+            return
+        
+        # Missing last_seen/last_heartbeat fall back to the model defaults
+        for device in DEVICE_LIST_ADAPTER.validate_python(devices_list):
+            self.devices_db[device.device] = device
+            self._invalidate(device.device)
+
+        # Freshly loaded state is already on disk
+        self._changed.clear()
+        self._written_digest = None
+        logger.info("Loaded %s devices from %s", len(self.devices_db), self.db_path or self.config_file)
+
     def create_default_config(self):
         default_devices = [
             {
@@ -79,94 +243,415 @@ class ConfigManager:
         ]
 
         default_config = {"devices": default_devices}
-
-        with open(self.config_file, 'w') as f:
-            json.dump(default_config, f, indent=4, default=str)
+        if self._db is not None:
+            self._write_rows(default_devices, [])
+        else:
+            self._write_config(default_config)
 
         for device_data in default_devices:
             device = Device(**device_data)
             self.devices_db[device.device] = device
+            self._invalidate(device.device)
+        self._changed.clear()
 
     def save_config(self):
         try:
-            devices_list = [device.model_dump() for device in self.devices_db.values()]
-            config_data = {"devices": devices_list}
-
-            with open(self.config_file, 'w') as f:
-                json.dump(config_data, f, indent=4, default=str)
+            if self._db is not None:
+                self._save_changed_rows()
+            else:
+                self._prepare_json_write()()
+            logger.info("Configuration saved to %s", self.db_path or self.config_file)
+        except Exception as e:
+            # Next write rebuilds the whole file rather than journaling on top of a gap
+            self._journal_size = self.journal_max_bytes
+            logger.error("Error saving config: %s", e)
 
-            logger.info(f"Configuration saved to {self.config_file}")
+    async def save_config_async(self):
+        """save_config with the encode and file write run off the event loop"""
+        if self._db is not None:
+            # Only the changed rows are written - cheap enough to stay on the loop
+            self.save_config()
+            return
+        
+        try:
+            # Snapshot on the loop thread; the worker thread never touches devices_db
+            await asyncio.get_running_loop().run_in_executor(self._save_executor, self._prepare_json_write())
+            logger.info("Configuration saved to %s", self.config_file)
         except Exception as e:
-            logger.error(f"Error saving config: {e}")
+            self._journal_size = self.journal_max_bytes
+            logger.error("Error saving config: %s", e)
+
+    def _prepare_json_write(self):
+        """Snapshot what needs writing and return the I/O step as a callable"""
+        changed, self._changed = self._changed, set()
+        
+        if self.journal_max_bytes > 0:
+            entries = b"".join(
+                orjson.dumps({"op": "upsert", "device": self._dump_device(device_id, self.devices_db[device_id])}) + b"\n"
+                if device_id in self.devices_db else
+                orjson.dumps({"op": "delete", "device": device_id}) + b"\n"
+                for device_id in changed
+            )
+            if self._journal_size + len(entries) <= self.journal_max_bytes:
+                self._journal_size += len(entries)
+                return partial(self._append_journal, entries)
+        
+        self._journal_size = 0
+        return self._config_writer()
+
+    def _append_journal(self, entries: bytes):
+        with open(self.journal_file, 'ab') as f:
+            f.write(entries)
+
+    def _snapshot_config(self) -> dict:
+        return {"devices": [self._dump_device(device_id, device) for device_id, device in self.devices_db.items()]}
+
+    def _invalidate(self, device_id: str):
+        self.version += 1
+        self._dumped.pop(device_id, None)
+        self._encoded.pop(device_id, None)
+        self._devices_json = None
+        self._changed.add(device_id)
+        
+        for device_ids in self._by_status.values():
+            device_ids.pop(device_id, None)
+        device = self.devices_db.get(device_id)
+        if device is not None:
+            self._by_status[device.status][device_id] = None
+        if self._positions is not None and (device is None) == (device_id in self._positions):
+            self._positions = None
+        self._schedule_deadline(device_id, device)
+
+    def _schedule_deadline(self, device_id: str, device: Optional[Device]):
+        if device is None or device.status != DeviceStatus.connected:
+            self._deadline_of.pop(device_id, None)
+            self._epoch_of.pop(device_id, None)
+            return
+        
+        last_heartbeat  = device.last_heartbeat
+        last_seen       = device.last_seen
+        heartbeat_ts    = last_heartbeat.timestamp() if last_heartbeat else None
+        # Heartbeats stamp both fields with the same datetime - convert it once
+        seen_ts         = heartbeat_ts if last_seen is last_heartbeat else (last_seen.timestamp() if last_seen else None)
+        
+        deadlines = []
+        if heartbeat_ts is not None:
+            deadlines.append(heartbeat_ts + self.heartbeat_timeout_seconds)
+        if seen_ts is not None:
+            deadlines.append(seen_ts + self.status_timeout_seconds)
+        deadline = min(deadlines) if deadlines else time.time()
+        self._epoch_of[device_id] = (heartbeat_ts, seen_ts)
+        
+        if self._deadline_of.get(device_id) == deadline:
+            return
+        
+        # Wake the monitor only if this moves the earliest deadline forward
+        if not self._deadlines or deadline < self._deadlines[0][0]:
+            self._deadline_wake.set()
+        self._deadline_of[device_id] = deadline
+        heapq.heappush(self._deadlines, (deadline, device_id))
+
+    def next_deadline(self) -> Optional[float]:
+        """Earliest time.time() at which a connected device can time out, None if none are connected"""
+        while self._deadlines:
+            deadline, device_id = self._deadlines[0]
+            if self._deadline_of.get(device_id) == deadline:
+                return deadline
+            heapq.heappop(self._deadlines)
+        return None
+
+    async def wait_for_next_deadline(self, max_wait: float):
+        """Sleep until the earliest device deadline, an earlier one being scheduled, or max_wait"""
+        self._deadline_wake.clear()
+        deadline    = self.next_deadline()
+        delay       = max_wait if deadline is None else min(max_wait, max(0.0, deadline - time.time()))
+        try:
+            # Small margin - the timeout checks use strict comparisons
+            await asyncio.wait_for(self._deadline_wake.wait(), timeout=delay + 0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    def _save_changed_rows(self):
+        changed, self._changed = self._changed, set()
+        upserts = [self._dump_device(device_id, self.devices_db[device_id]) for device_id in changed if device_id in self.devices_db]
+        deletes = [(device_id,) for device_id in changed if device_id not in self.devices_db]
+        try:
+            self._write_rows(upserts, deletes)
+        except Exception:
+            # Keep them pending for the next flush
+            self._changed |= changed
+            raise
+
+    def _write_rows(self, upserts: list, deletes: list):
+        self._db.execute("BEGIN")
+        try:
+            self._db.executemany(UPSERT_DEVICE, upserts)
+            self._db.executemany(DELETE_DEVICE, deletes)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """Flush pending changes, compact the journal and release the SQLite connection"""
+        self._save_executor.shutdown(wait=True)
+        self.flush()
+        if self._db is None and self._journal_size:
+            self._journal_size = 0
+            self._config_writer()()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def devices_json(self) -> bytes:
+        """The /devices response body, cached until a device changes"""
+        if self._devices_json is None:
+            # Splice per-device fragments so one change re-encodes one device, not the fleet
+            encoded = self._encoded
+            for device_id, device in self.devices_db.items():
+                if device_id not in encoded:
+                    encoded[device_id] = orjson.dumps(self._dump_device(device_id, device))
+            self._devices_json = b'{"devices":[' + b','.join(encoded[device_id] for device_id in self.devices_db) + b']}'
+        return self._devices_json
+
+    def device_json(self, device_id: str) -> Optional[bytes]:
+        """One device's encoded body, sharing the fragment cache behind devices_json()"""
+        device = self.devices_db.get(device_id)
+        if device is None:
+            return None
+        encoded = self._encoded.get(device_id)
+        if encoded is None:
+            encoded = self._encoded[device_id] = orjson.dumps(self._dump_device(device_id, device))
+        return encoded
+
+    def dump_devices(self, devices: Dict[str, Device]) -> list:
+        """JSON-ready dicts for a subset of devices, reusing the cached dumps"""
+        return [self._dump_device(device_id, device) for device_id, device in devices.items()]
+
+    def _dump_device(self, device_id: str, device: Device) -> dict:
+        dumped = self._dumped.get(device_id)
+        if dumped is None:
+            dumped = self._dumped[device_id] = device.to_json_dict()
+        return dumped
+
+    def _config_writer(self):
+        """Snapshot the whole config and return its write as a callable"""
+        if self.json_indent:
+            return partial(self._write_config, self._snapshot_config())
+        # Compact output is byte-for-byte the cached /devices body
+        return partial(self._write_payload, self.devices_json())
+
+    def _write_config(self, config_data: dict):
+        """Serialize with orjson, indented, and swap the file in atomically"""
+        self._write_payload(orjson.dumps(config_data, option=orjson.OPT_INDENT_2))
+
+    def _write_payload(self, payload: bytes):
+        digest      = hashlib.blake2b(payload, digest_size=16).digest()
+        if digest == self._written_digest and self.config_file.exists():
+            self.journal_file.unlink(missing_ok=True)
+            return
+        
+        if self._atomic_writes:
+            self._write_atomic(payload)
+        else:
+            self._write_in_place(payload)
+        
+        self._written_digest = digest
+        
+        # The file now holds everything the journal did
+        self.journal_file.unlink(missing_ok=True)
+
+    def _write_atomic(self, payload: bytes):
+        tmp_file    = self.config_file.with_name(self.config_file.name + ".tmp")
+        
+        try:
+            f = open(tmp_file, 'wb')
+        except OSError as e:
+            # docker-compose runs as an unprivileged user and bind-mounts only the config file,
+            # so its directory is not writable; the file itself still is
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                raise
+            logger.warning("Cannot create %s (%s) - writing %s in place from now on", tmp_file, e.strerror, self.config_file)
+            self._atomic_writes = False
+            self._write_in_place(payload)
+            return
+        
+        with f:
+            f.write(payload)
+            # Data must be on disk before the rename, or a crash can leave an empty file behind
+            f.flush()
+            os.fsync(f.fileno())
+        
+        try:
+            os.replace(tmp_file, self.config_file)
+        except OSError as e:
+            # A single-file bind mount (docker-compose) cannot be renamed over
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            os.unlink(tmp_file)
+            self._write_in_place(payload)
+
+    def _write_in_place(self, payload: bytes):
+        with open(self.config_file, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _schedule_save(self, delay: Optional[float] = None):
+        """Mark the config dirty and write it once the burst settles
+        
+        A delay longer than the debounce window marks the change as low priority:
+        it rides along with the next regular save or is written once the delay ends.
+        """
+        self._dirty             = True
+        if delay is None:
+            delay                   = self.save_debounce_seconds
+            self._pending_updates  += 1
+        
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (scripts, startup) - nothing to coalesce with
+            self.flush()
+            return
+        
+        if self._pending_updates >= self.save_max_pending:
+            self._start_flush(loop)
+            return
+        
+        # Re-arm only for an earlier deadline; a handle whose time has passed counts as unarmed
+        now     = loop.time()
+        handle  = self._flush_handle
+        if handle is None or handle.when() <= now or now + delay < handle.when():
+            if handle is not None:
+                handle.cancel()
+            self._flush_handle = loop.call_later(delay, self._start_flush, loop)
+
+    def _start_flush(self, loop: asyncio.AbstractEventLoop):
+        # The timer is spent (or superseded) either way, so the next change arms a fresh one;
+        # a flush that is already writing picks the change up in its `while self._dirty` loop
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush_async())
+
+    async def flush_async(self):
+        """Write pending changes to disk without blocking the event loop"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        # One writer at a time, and each write snapshots the latest state
+        async with self._flush_lock:
+            while self._dirty:
+                self._dirty             = False
+                self._pending_updates   = 0
+                await self.save_config_async()
+
+    def flush(self):
+        """Write pending changes to disk, if any"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        if not self._dirty:
+            return
+        
+        self._dirty             = False
+        self._pending_updates   = 0
+        self.save_config()
 
     def get_device(self, device_id: str) -> Optional[Device]:
         return self.devices_db.get(device_id)
     
-    def get_all_devices(self) -> Dict[str, Device]:
-        return self.devices_db.copy()
+    def device_position(self, device_id: str) -> Optional[int]:
+        """1-based position of the device in registry order, None if unknown"""
+        if self._positions is None:
+            self._positions = {device_id: index for index, device_id in enumerate(self.devices_db, start=1)}
+        return self._positions.get(device_id)
+    
+    def get_all_devices(self) -> Mapping[str, Device]:
+        return self.devices_view
     
     def update_device_status(self, device_id: str, status: DeviceStatus, update_heartbeat: bool = True):
         """Update device status with optional heartbeat timestamp update"""
-        if device_id in self.devices_db:
+        device = self.devices_db.get(device_id)
+        if device is not None:
             current_time = datetime.now()
-            self.devices_db[device_id].status = status
+            keep_alive   = update_heartbeat and device.status == status
+            device.status = status
             
             if update_heartbeat:
-                self.devices_db[device_id].last_heartbeat = current_time
+                device.last_heartbeat = current_time
                 
             # Always update last_seen when we receive any status update
-            self.devices_db[device_id].last_seen = current_time
+            device.last_seen = current_time
+            self._invalidate(device_id)
             
-            self.save_config()
-            logger.info(f"Updated {device_id} status to {status.value} at {current_time}")
+            # Only transitions are urgent; the in-memory timestamps are what the timeout checks use
+            self._schedule_save(self.heartbeat_persist_seconds if keep_alive else None)
+            logger.debug("Updated %s status to %s at %s", device_id, status.value, current_time)
     
     def update_device_relay(self, device_id: str, relay_state: RelayState):
-        if device_id in self.devices_db:
+        device = self.devices_db.get(device_id)
+        if device is not None:
             current_time = datetime.now()
-            self.devices_db[device_id].relay_state = relay_state
-            self.devices_db[device_id].last_seen = current_time
-            self.save_config()
-            logger.info(f"Updated {device_id} relay to {relay_state.value} at {current_time}")
+            device.relay_state = relay_state
+            device.last_seen = current_time
+            self._invalidate(device_id)
+            self._schedule_save()
+            logger.info("Updated %s relay to %s at %s", device_id, relay_state.value, current_time)
     
     def check_device_timeouts(self) -> Dict[str, DeviceStatus]:
 
-        current_time    = datetime.now()
-        timeout_updates = {}
+        timeout_updates     = {}
         
-        for device_id, device in self.devices_db.items():
-            if device.status == DeviceStatus.connected:
-                
-                if device.last_heartbeat:
-                    time_since_heartbeat = current_time - device.last_heartbeat
-                    if time_since_heartbeat.total_seconds() > self.heartbeat_timeout_seconds:
-                        logger.warning(f"Device {device_id} heartbeat timeout: {time_since_heartbeat.total_seconds()}s > {self.heartbeat_timeout_seconds}s")
-                        self.devices_db[device_id].status   = DeviceStatus.disconnected
-                        timeout_updates[device_id]          = DeviceStatus.disconnected
-                        continue
-                
-                if device.last_seen:
-                    time_since_seen = current_time - device.last_seen
-                    if time_since_seen.total_seconds() > self.status_timeout_seconds:
-                        logger.warning(f"Device {device_id} status timeout: {time_since_seen.total_seconds()}s > {self.status_timeout_seconds}s")
-                        self.devices_db[device_id].status = DeviceStatus.disconnected
-                        timeout_updates[device_id] = DeviceStatus.disconnected
-                        continue
-                
-                if not device.last_seen and not device.last_heartbeat:
-                    logger.warning(f"Device {device_id} marked connected but has no timestamp data")
-                    self.devices_db[device_id].status = DeviceStatus.disconnected
+        # Pop only the deadlines that have passed; superseded heap entries are dropped on the way
+        now     = time.time()
+        due     = []
+        while self._deadlines and self._deadlines[0][0] < now:
+            deadline, device_id = heapq.heappop(self._deadlines)
+            if self._deadline_of.get(device_id) == deadline:
+                del self._deadline_of[device_id]
+                due.append(device_id)
+        
+        for device_id in due:
+            device                  = self.devices_db[device_id]
+            heartbeat_ts, seen_ts   = self._epoch_of[device_id]
+            
+            # Same float expressions as the heap deadline, so a due device always matches one branch
+            if heartbeat_ts is not None:
+                if heartbeat_ts + self.heartbeat_timeout_seconds < now:
+                    logger.warning("Device %s heartbeat timeout: %.1fs > %ss", device_id, now - heartbeat_ts, self.heartbeat_timeout_seconds)
+                    device.status                       = DeviceStatus.disconnected
+                    timeout_updates[device_id]          = DeviceStatus.disconnected
+                    continue
+            
+            if seen_ts is not None:
+                if seen_ts + self.status_timeout_seconds < now:
+                    logger.warning("Device %s status timeout: %.1fs > %ss", device_id, now - seen_ts, self.status_timeout_seconds)
+                    device.status = DeviceStatus.disconnected
                     timeout_updates[device_id] = DeviceStatus.disconnected
+                    continue
+            
+            if heartbeat_ts is None and seen_ts is None:
+                logger.warning("Device %s marked connected but has no timestamp data", device_id)
+                device.status = DeviceStatus.disconnected
+                timeout_updates[device_id] = DeviceStatus.disconnected
         
         if timeout_updates:
-            self.save_config()
-            logger.info(f"Updated {len(timeout_updates)} devices due to timeout")
+            for device_id in timeout_updates:
+                self._invalidate(device_id)
+            self._schedule_save()
+            logger.info("Updated %s devices due to timeout", len(timeout_updates))
         
         return timeout_updates
     
     def get_device_connection_info(self, device_id: str) -> Dict[str, any]:
 
-        device          = self.get_device(device_id)
-        if not device:
+        device          = self.devices_db.get(device_id)
+        if device is None:
             return {"error": "Device not found"}
         
         current_time    = datetime.now()
@@ -182,9 +667,10 @@ class ConfigManager:
             info["seconds_since_last_seen"]     = (current_time - device.last_seen).total_seconds()
         
         if device.last_heartbeat:
-            info["seconds_since_heartbeat"]     = (current_time - device.last_heartbeat).total_seconds()
+            since_heartbeat                     = (current_time - device.last_heartbeat).total_seconds()
+            info["seconds_since_heartbeat"]     = since_heartbeat
             info["heartbeat_timeout_threshold"] = self.heartbeat_timeout_seconds
-            info["is_heartbeat_overdue"]        = (current_time - device.last_heartbeat).total_seconds() > self.heartbeat_timeout_seconds
+            info["is_heartbeat_overdue"]        = since_heartbeat > self.heartbeat_timeout_seconds
         
         return info
     
@@ -195,14 +681,16 @@ class ConfigManager:
             device.last_heartbeat = None
             
         self.devices_db[device.device] = device
-        self.save_config()
-        logger.info(f"Added new device: {device.device}")
+        self._invalidate(device.device)
+        self._schedule_save()
+        logger.info("Added new device: %s", device.device)
     
     def remove_device(self, device_id: str):
         if device_id in self.devices_db:
             del self.devices_db[device_id]
-            self.save_config()
-            logger.info(f"Removed device: {device_id}")
+            self._invalidate(device_id)
+            self._schedule_save()
+            logger.info("Removed device: %s", device_id)
     
     def device_exists(self, device_id: str) -> bool:
         return device_id in self.devices_db
@@ -211,25 +699,23 @@ class ConfigManager:
         return len(self.devices_db)
     
     def get_connected_devices_count(self) -> int:
-        return sum(1 for device in self.devices_db.values() 
-                  if device.status == DeviceStatus.connected)
+        return len(self._by_status[DeviceStatus.connected])
     
     def get_devices_by_status(self, status: DeviceStatus) -> Dict[str, Device]:
-        return {device_id: device for device_id, device in self.devices_db.items()
-                if device.status == status}
+        return {device_id: self.devices_db[device_id] for device_id in self._by_status[status]}
     
     def get_stale_devices(self, threshold_seconds: int = None) -> Dict[str, Device]:
         """Get devices that haven't been seen within the threshold"""
         if threshold_seconds is None:
             threshold_seconds = self.heartbeat_timeout_seconds
             
-        current_time    = datetime.now()
+        # One cutoff instead of a timedelta + total_seconds() per device
+        cutoff          = datetime.now() - timedelta(seconds=threshold_seconds)
         stale_devices   = {}
         
         for device_id, device in self.devices_db.items():
             if device.last_seen:
-                time_since_seen = current_time - device.last_seen
-                if time_since_seen.total_seconds() > threshold_seconds:
+                if device.last_seen < cutoff:
                     stale_devices[device_id]    = device
             elif device.status == DeviceStatus.connected:
             
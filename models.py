@@ -19,6 +19,19 @@ class Device(BaseModel):
     last_seen       : Optional[datetime] = Field(default=None, description="Last heartbeat timestamp")
     last_heartbeat  : Optional[datetime] = Field(default=None, description="Last status message timestamp")
 
+    def to_json_dict(self) -> dict:
+        """model_dump(mode="json") without the serializer round trip; keep in step with the fields"""
+        last_seen       = self.last_seen
+        last_heartbeat  = self.last_heartbeat
+        return {
+            "device"            : self.device
+            , "status"          : self.status.value
+            , "relay_state"     : self.relay_state.value
+            , "mqtt_topic"      : self.mqtt_topic
+            , "last_seen"       : last_seen.isoformat() if last_seen else None
+            , "last_heartbeat"  : last_heartbeat.isoformat() if last_heartbeat else None
+        }
+
 class DeviceControl(BaseModel):
     device      : str = Field(..., description="Device identifier") 
     relay_state : RelayState = Field(..., description="Desired relay state")
@@ -1,5 +1,10 @@
-from typing import Dict
+import asyncio
+import logging
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple
 
+import orjson
 import paho.mqtt.client as mqtt
 
 from config import settings
@@ -8,6 +13,28 @@ from logger import get_logger
 
 logger = get_logger('mqtt')
 
+MQTT_KEEPALIVE_SECONDS          = 60
+RECONNECT_MAX_DELAY_SECONDS     = 128
+SOCKET_BUFFER_BYTES             = 64 * 1024
+
+STATUS_SUFFIX                   = "/status"
+RELAY_STATE_SUFFIX              = "/relay/state"
+RELAY_SET_SUFFIX                = "/relay/set"
+WILDCARD_TOPICS                 = ["+" + STATUS_SUFFIX, "+" + RELAY_STATE_SUFFIX]
+
+# Payload -> (status, is_heartbeat); one dict probe instead of list scans per message
+STATUS_PAYLOADS = {
+    "online"            : (DeviceStatus.connected, True)
+    , "connected"       : (DeviceStatus.connected, True)
+    , "1"               : (DeviceStatus.connected, True)
+    , "true"            : (DeviceStatus.connected, True)
+    , "offline"         : (DeviceStatus.disconnected, False)
+    , "disconnected"    : (DeviceStatus.disconnected, False)
+    , "0"               : (DeviceStatus.disconnected, False)
+    , "false"           : (DeviceStatus.disconnected, False)
+}
+RELAY_ON_PAYLOADS = frozenset({"on", "1", "true", "high"})
+
 class MQTTClient:
     def __init__(self, config_manager):
         self.config_manager = config_manager
@@ -17,44 +44,147 @@ class MQTTClient:
         self.username       = settings.MQTT_USERNAME
         self.password       = settings.MQTT_PASSWORD
         self.is_connected   = False
+        self.publish_timeout_seconds = settings.MQTT_PUBLISH_TIMEOUT_SECONDS
+        self.relay_qos               = settings.MQTT_RELAY_QOS
+        # Two broker-side filters cover every device; adding or removing one is then local only
+        self.wildcard_subscribe      = settings.MQTT_WILDCARD_SUBSCRIBE
+        
+        # QoS 1 publishes awaiting PUBACK, keyed by message id
+        self._pending_acks  : Dict[int, asyncio.Future] = {}
+        
+        # Encoded /mqtt/status body, keyed by the state it was built from
+        self._status_json   : Optional[Tuple[tuple, bytes]] = None
+        
+        # Exact topic -> device_id lookup for the message hot path
+        self.status_topic_map       : Dict[str, str] = {}
+        self.relay_state_topic_map  : Dict[str, str] = {}
+        # device_id -> command topic, built once per device instead of per publish
+        self.relay_set_topics       : Dict[str, str] = {}
+        
+        # The paho client is driven from the asyncio loop instead of a loop_start() thread
+        self._loop              = None
+        self._loop_thread_id    = None
+        self._misc_task         = None
+        self._stopping          = False
+        self._reconnect_delay   = 1
 
     async def connect(self):
         """Connect to MQTT broker"""
         try:
-            self.client = mqtt.Client()
+            self._loop              = asyncio.get_running_loop()
+            self._loop_thread_id    = threading.get_ident()
+            self._stopping          = False
+            self.client     = mqtt.Client()
 
             if self.username and self.password:
                 self.client.username_pw_set(self.username, self.password)
 
             # Set callback functions
             self.client.on_connect      = self._on_connect
-            self.client.on_message      = self._on_message
+            self.client.on_message      = self._make_message_handler()
             self.client.on_disconnect   = self._on_disconnect
             self.client.on_subscribe    = self._on_subscribe
             self.client.on_publish      = self._on_publish
+            
+            # Socket callbacks hand the network I/O to the event loop
+            self.client.on_socket_open              = self._on_socket_open
+            self.client.on_socket_close             = self._on_socket_close
+            self.client.on_socket_register_write    = self._on_socket_register_write
+            self.client.on_socket_unregister_write  = self._on_socket_unregister_write
 
-            # Connect to broker
-            self.client.connect(self.broker_host, self.broker_port, 60)
-            self.client.loop_start()
+            # Connect to broker; DNS lookup and the TCP handshake block, so keep them off the loop
+            await asyncio.to_thread(
+                self.client.connect, self.broker_host, self.broker_port, MQTT_KEEPALIVE_SECONDS
+            )
+            self._misc_task = self._loop.create_task(self._misc_loop())
 
-            logger.info(f"MQTT: Connecting to {self.broker_host}:{self.broker_port}")
+            logger.info("MQTT: Connecting to %s:%s", self.broker_host, self.broker_port)
 
         except Exception as e:
-            logger.error(f"MQTT: Failed to connect - {e}")
+            logger.error("MQTT: Failed to connect - %s", e)
             raise
 
     async def disconnect(self):
         """Disconnect from MQTT broker"""
         if self.client:
-            self.client.loop_stop()
+            self._stopping = True
             self.client.disconnect()
+            # Flush the DISCONNECT packet now; paho closes the socket once it is written
+            self.client.loop_write()
+            
+            if self._misc_task and not self._misc_task.done():
+                self._misc_task.cancel()
+                try:
+                    await self._misc_task
+                except asyncio.CancelledError:
+                    pass
+            
             self.is_connected = False
             logger.info("MQTT: Disconnected")
 
+    def _on_socket_open(self, client, userdata, sock):
+        # Small control packets - don't let Nagle hold PUBLISH/PUBACK back
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_BYTES)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_BYTES)
+        except (OSError, AttributeError) as e:
+            # TLS/websocket wrappers may not expose setsockopt
+            logger.debug("MQTT: Could not tune socket options - %s", e)
+        
+        self._on_loop(self._loop.add_reader, sock.fileno(), client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        # paho closes the socket right after this returns, so pass the fd rather than the socket
+        fd = sock.fileno()
+        self._on_loop(self._loop.remove_reader, fd)
+        self._on_loop(self._loop.remove_writer, fd)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self._loop.add_writer, sock.fileno(), client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self._loop.remove_writer, sock.fileno())
+
+    def _on_loop(self, callback, *args):
+        """Run a selector (un)registration on the loop thread
+        
+        connect()/reconnect() run in a worker thread and fire the socket callbacks from there.
+        """
+        if threading.get_ident() == self._loop_thread_id:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    async def _misc_loop(self):
+        """Run paho's periodic housekeeping and reconnect with exponential backoff"""
+        while not self._stopping:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                await asyncio.sleep(1)
+                continue
+            
+            # Socket is gone (broker restart, network drop, keepalive timeout)
+            await asyncio.sleep(self._reconnect_delay)
+            if self._stopping:
+                break
+            
+            logger.info("MQTT: Reconnecting to %s:%s", self.broker_host, self.broker_port)
+            try:
+                # Blocking DNS lookup and TCP connect (up to paho's 5s timeout) - not on the loop
+                await asyncio.to_thread(self.client.reconnect)
+            except (OSError, mqtt.WebsocketConnectionError) as e:
+                logger.warning("MQTT: Reconnect failed - %s", e)
+                self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY_SECONDS)
+            except Exception:
+                # Anything else would end this task, and with it keepalives and reconnects
+                logger.exception("MQTT: Unexpected error while reconnecting")
+                self._reconnect_delay = min(self._reconnect_delay * 2, RECONNECT_MAX_DELAY_SECONDS)
+
     def _on_connect(self, client, userdata, flags, rc):
         """Callback for when client connects to broker"""
         if rc == 0:
-            self.is_connected = True
+            self.is_connected       = True
+            self._reconnect_delay   = 1
             logger.info("MQTT: Connected successfully")
             
             # Subscribe to all device status topics
@@ -62,97 +192,149 @@ class MQTTClient:
             
         else:
             self.is_connected = False
-            logger.error(f"MQTT: Connection failed with code {rc}")
+            logger.error("MQTT: Connection failed with code %s", rc)
 
     def _on_disconnect(self, client, userdata, rc):
         """Callback for when client disconnects from broker"""
         self.is_connected = False
         if rc != 0:
-            logger.warning(f"MQTT: Unexpected disconnection (code: {rc})")
+            logger.warning("MQTT: Unexpected disconnection (code: %s)", rc)
         else:
             logger.info("MQTT: Disconnected cleanly")
 
     def _on_subscribe(self, client, userdata, mid, granted_qos):
         """Callback for when subscription is confirmed"""
-        logger.debug(f"MQTT: Subscription confirmed (mid: {mid}, qos: {granted_qos})")
+        logger.debug("MQTT: Subscription confirmed (mid: %s, qos: %s)", mid, granted_qos)
 
     def _on_publish(self, client, userdata, mid):
         """Callback for when message is published"""
-        logger.debug(f"MQTT: Message published (mid: {mid})")
+        logger.debug("MQTT: Message published (mid: %s)", mid)
+        
+        future = self._pending_acks.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(mid)
 
-    def _on_message(self, client, userdata, msg):
-        """Callback for when message is received"""
-        try:
-            topic   = msg.topic
-            payload = msg.payload.decode('utf-8')
-            
-            logger.info(f"MQTT: Received - Topic: {topic}, Payload: {payload}")
-            
-            # Handle different message types
-            if "/status" in topic:
-                self._handle_status_message(topic, payload)
-            elif "/relay/state" in topic:
-                self._handle_relay_state_message(topic, payload)
-            else:
-                logger.debug(f"MQTT: Unhandled topic: {topic}")
+    def _make_message_handler(self):
+        """Build on_message with the per-message lookups bound as closure locals
+        
+        The topic maps are only ever mutated in place, so binding them once is safe.
+        """
+        status_topic_map        = self.status_topic_map
+        relay_state_topic_map   = self.relay_state_topic_map
+        handle_status           = self._handle_status_message
+        handle_relay_state      = self._handle_relay_state_message
+        handle_unrouted         = self._handle_unrouted_message
+        debug_enabled           = logger.isEnabledFor
+        
+        def on_message(client, userdata, msg):
+            """Callback for when message is received"""
+            try:
+                topic   = msg.topic
+                payload = msg.payload.decode('utf-8')
+                
+                # Per-message line: keep formatting off the hot path unless DEBUG is on
+                if debug_enabled(logging.DEBUG):
+                    logger.debug("MQTT: Received - Topic: %s, Payload: %s", topic, payload)
+                
+                # Handle different message types
+                device_id = status_topic_map.get(topic)
+                if device_id is not None:
+                    handle_status(device_id, payload)
+                    return
+                
+                device_id = relay_state_topic_map.get(topic)
+                if device_id is not None:
+                    handle_relay_state(device_id, payload)
+                    return
+                
+                handle_unrouted(topic)
 
-        except Exception as e:
-            logger.error(f"MQTT: Error processing message - {e}")
+            except Exception as e:
+                logger.error("MQTT: Error processing message - %s", e)
+        
+        return on_message
 
-    def _handle_status_message(self, topic: str, payload: str):
+    def _handle_unrouted_message(self, topic: str):
+        """Miss path only: a device topic for something we no longer route"""
+        if self.wildcard_subscribe:
+            # Other clients' devices on the same broker match the wildcards too
+            logger.debug("MQTT: Ignoring topic for an unknown device: %s", topic)
+        elif topic.endswith(STATUS_SUFFIX):
+            logger.warning("MQTT: Received status for unknown device: %s", topic[:-len(STATUS_SUFFIX)])
+        elif topic.endswith(RELAY_STATE_SUFFIX):
+            logger.warning("MQTT: Received relay state for unknown device: %s", topic[:-len(RELAY_STATE_SUFFIX)])
+        else:
+            logger.debug("MQTT: Unhandled topic: %s", topic)
+
+    def _handle_status_message(self, device_id: str, payload: str):
         """Handle device status messages with improved LWT and heartbeat detection"""
-        device_id = topic.replace("/status", "")
+        device = self.config_manager.get_device(device_id)
         
-        if device_id in self.config_manager.devices_db:
+        if device is not None:
 
-            if payload.lower() in ["online", "connected", "1", "true"]:
-                new_status      = DeviceStatus.connected
-                is_heartbeat    = True 
-            elif payload.lower() in ["offline", "disconnected", "0", "false"]:
-                new_status      = DeviceStatus.disconnected
-                is_heartbeat    = False 
-            else:
-                logger.warning(f"MQTT: Unknown status payload '{payload}' for device {device_id}")
+            # Firmware sends lowercase; only fold case when the exact probe misses
+            parsed = STATUS_PAYLOADS.get(payload) or STATUS_PAYLOADS.get(payload.lower())
+            if parsed is None:
+                logger.warning("MQTT: Unknown status payload '%s' for device %s", payload, device_id)
                 return
+            new_status, is_heartbeat = parsed
         
-            current_status      = self.config_manager.devices_db[device_id].status
+            current_status      = device.status
             if current_status != new_status:
                 self.config_manager.update_device_status(device_id, new_status, update_heartbeat=is_heartbeat)
-                logger.info(f"MQTT: Device {device_id} status changed: {current_status.value} → {new_status.value}")
+                logger.info("MQTT: Device %s status changed: %s → %s", device_id, current_status.value, new_status.value)
                 
                 if new_status == DeviceStatus.disconnected:
                     if is_heartbeat:
-                        logger.info(f"MQTT: Device {device_id} sent explicit disconnect")
+                        logger.info("MQTT: Device %s sent explicit disconnect", device_id)
                     else:
-                        logger.warning(f"MQTT: Device {device_id} disconnected via LWT (Last Will and Testament)")
+                        logger.warning("MQTT: Device %s disconnected via LWT (Last Will and Testament)", device_id)
             else:
                 if new_status == DeviceStatus.connected and is_heartbeat:
                     self.config_manager.update_device_status(device_id, new_status, update_heartbeat=True)
-                    logger.debug(f"MQTT: Heartbeat received from {device_id}")
+                    logger.debug("MQTT: Heartbeat received from %s", device_id)
         else:
-            logger.warning(f"MQTT: Received status for unknown device: {device_id}")
+            logger.warning("MQTT: Received status for unknown device: %s", device_id)
 
-    def _handle_relay_state_message(self, topic: str, payload: str):
+    def _handle_relay_state_message(self, device_id: str, payload: str):
         """Handle relay state feedback messages"""
-        device_id = topic.replace("/relay/state", "")
+        device = self.config_manager.get_device(device_id)
         
-        if device_id in self.config_manager.devices_db:
+        if device is not None:
             
-            if payload.lower() in ["on", "1", "true", "high"]:
-                new_state = RelayState.on
-            else:
-                new_state = RelayState.off
+            is_on     = payload in RELAY_ON_PAYLOADS or payload.lower() in RELAY_ON_PAYLOADS
+            new_state = RelayState.on if is_on else RelayState.off
             
-            current_state = self.config_manager.devices_db[device_id].relay_state
+            current_state = device.relay_state
             if current_state != new_state:
                 self.config_manager.update_device_relay(device_id, new_state)
-                logger.info(f"MQTT: Device {device_id} relay state changed: {current_state.value} → {new_state.value}")
+                logger.info("MQTT: Device %s relay state changed: %s → %s", device_id, current_state.value, new_state.value)
             else:
     
                 self.config_manager.update_device_relay(device_id, new_state)
-                logger.debug(f"MQTT: Relay state confirmation from {device_id}: {new_state.value}")
+                logger.debug("MQTT: Relay state confirmation from %s: %s", device_id, new_state.value)
         else:
-            logger.warning(f"MQTT: Received relay state for unknown device: {device_id}")
+            logger.warning("MQTT: Received relay state for unknown device: %s", device_id)
+
+    def register_device(self, device_id: str):
+        """Route the device's inbound topics to their handlers"""
+        self.status_topic_map[device_id + STATUS_SUFFIX]            = device_id
+        self.relay_state_topic_map[device_id + RELAY_STATE_SUFFIX]  = device_id
+        self.relay_set_topics[device_id]                            = device_id + RELAY_SET_SUFFIX
+
+    def unregister_device(self, device_id: str):
+        """Stop routing the device's inbound topics"""
+        self.status_topic_map.pop(device_id + STATUS_SUFFIX, None)
+        self.relay_state_topic_map.pop(device_id + RELAY_STATE_SUFFIX, None)
+        self.relay_set_topics.pop(device_id, None)
+
+    def _relay_set_topic(self, device_id: str) -> str:
+        # Devices added while disconnected are registered on the next connect
+        return self.relay_set_topics.get(device_id) or device_id + RELAY_SET_SUFFIX
+
+    @staticmethod
+    def _device_topics(device_id: str):
+        return [device_id + STATUS_SUFFIX, device_id + RELAY_STATE_SUFFIX]
 
     def _subscribe_to_device_topics(self):
         """Subscribe to all device-related topics"""
@@ -160,18 +342,27 @@ class MQTTClient:
             logger.warning("MQTT: Cannot subscribe - not connected")
             return
 
-        for device_id in self.config_manager.devices_db.keys():
-            topics = [
-                f"{device_id}/status",
-                f"{device_id}/relay/state"
-            ]
-            
-            for topic in topics:
-                result, mid = self.client.subscribe(topic)
-                if result == mqtt.MQTT_ERR_SUCCESS:
-                    logger.info(f"MQTT: Subscribed to {topic}")
-                else:
-                    logger.error(f"MQTT: Failed to subscribe to {topic}")
+        self.status_topic_map.clear()
+        self.relay_state_topic_map.clear()
+        self.relay_set_topics.clear()
+        
+        topics = []
+        for device_id in self.config_manager.devices_view.keys():
+            self.register_device(device_id)
+            topics.extend(self._device_topics(device_id))
+        
+        if self.wildcard_subscribe:
+            topics = WILDCARD_TOPICS
+        
+        if not topics:
+            return
+        
+        # One SUBSCRIBE packet carrying every filter instead of one round-trip per topic
+        result, mid = self.client.subscribe([(topic, 0) for topic in topics])
+        if result == mqtt.MQTT_ERR_SUCCESS:
+            logger.info("MQTT: Subscribed to %s topics (mid: %s)", len(topics), mid)
+        else:
+            logger.error("MQTT: Failed to subscribe to device topics (error: %s)", result)
 
     def subscribe_device(self, device_id: str):
         """Subscribe to topics for a specific device"""
@@ -179,63 +370,118 @@ class MQTTClient:
             logger.warning("MQTT: Cannot subscribe - not connected")
             return False
 
-        topics = [
-            f"{device_id}/status",
-            f"{device_id}/relay/state"
-        ]
+        self.register_device(device_id)
+        if self.wildcard_subscribe:
+            return True
+        topics = self._device_topics(device_id)
         
-        success = True
-        for topic in topics:
-            result, mid = self.client.subscribe(topic)
-            if result == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"MQTT: Subscribed to {topic}")
-            else:
-                logger.error(f"MQTT: Failed to subscribe to {topic}")
-                success = False
+        result, mid = self.client.subscribe([(topic, 0) for topic in topics])
+        if result == mqtt.MQTT_ERR_SUCCESS:
+            logger.info("MQTT: Subscribed to %s", ', '.join(topics))
+            return True
         
-        return success
+        logger.error("MQTT: Failed to subscribe to %s", ', '.join(topics))
+        return False
 
     def unsubscribe_device(self, device_id: str):
         """Unsubscribe from topics for a specific device"""
+        self.unregister_device(device_id)
         if not self.is_connected:
             logger.warning("MQTT: Cannot unsubscribe - not connected")
             return False
+        if self.wildcard_subscribe:
+            return True
 
-        topics = [
-            f"{device_id}/status",
-            f"{device_id}/relay/state"
-        ]
+        topics = self._device_topics(device_id)
         
-        success = True
-        for topic in topics:
-            result, mid = self.client.unsubscribe(topic)
-            if result == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"MQTT: Unsubscribed from {topic}")
-            else:
-                logger.error(f"MQTT: Failed to unsubscribe from {topic}")
-                success = False
+        result, mid = self.client.unsubscribe(topics)
+        if result == mqtt.MQTT_ERR_SUCCESS:
+            logger.info("MQTT: Unsubscribed from %s", ', '.join(topics))
+            return True
         
-        return success
+        logger.error("MQTT: Failed to unsubscribe from %s", ', '.join(topics))
+        return False
 
-    def publish_relay_control(self, device_id: str, state: RelayState):
-        """Publish relay control command"""
+    async def publish_relay_control(self, device_id: str, state: RelayState):
+        """Publish relay control command and wait for the broker's PUBACK
+        
+        Raises asyncio.TimeoutError if the broker does not acknowledge within
+        MQTT_PUBLISH_TIMEOUT_SECONDS; local state is only updated once it does.
+        With MQTT_RELAY_QOS=0 there is no PUBACK and the state is updated right away.
+        """
         if not self.is_connected:
             raise Exception("MQTT client not connected")
         
-        topic   = f"{device_id}/relay/set"
+        topic   = self._relay_set_topic(device_id)
         payload = state.value
         
-        # Publish with QoS 1 (at least once delivery)
-        result  = self.client.publish(topic, payload, qos=1)
+        result  = self.client.publish(topic, payload, qos=self.relay_qos)
         
-        if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"MQTT: Published relay command - Topic: {topic}, Payload: {payload}")
-            # Update local state immediately for responsive UI
-            self.config_manager.update_device_relay(device_id, state)
-            return True
-        else:
-            logger.error(f"MQTT: Failed to publish to {topic} (error: {result.rc})")
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.error("MQTT: Failed to publish to %s (error: %s)", topic, result.rc)
             raise Exception(f"Failed to publish MQTT message (error: {result.rc})")
+        
+        if self.relay_qos:
+            # The PUBACK is read on this loop, so registering after publish() cannot miss it
+            future = self._loop.create_future()
+            self._pending_acks[result.mid] = future
+            try:
+                await asyncio.wait_for(future, timeout=self.publish_timeout_seconds)
+            except asyncio.TimeoutError:
+                logger.error("MQTT: No PUBACK for %s within %ss (mid: %s)", topic, self.publish_timeout_seconds, result.mid)
+                raise
+            finally:
+                self._pending_acks.pop(result.mid, None)
+        
+        logger.info("MQTT: Published relay command - Topic: %s, Payload: %s", topic, payload)
+        self.config_manager.update_device_relay(device_id, state)
+        return True
+
+    async def publish_many(self, commands: List[Tuple[str, RelayState]]) -> List[str]:
+        """Publish several relay commands back to back and wait for their PUBACKs together
+        
+        Every packet is queued before control returns to the loop, so paho drains
+        them in a single writer callback. Acknowledged devices are updated even if
+        others time out, in which case asyncio.TimeoutError is raised afterwards.
+        """
+        if not self.is_connected:
+            raise Exception("MQTT client not connected")
+        
+        # QoS 0 commands carry no future - there is nothing to wait for
+        pending : List[Tuple[str, RelayState, int, Optional[asyncio.Future]]] = []
+        not_done = set()
+        try:
+            for device_id, state in commands:
+                topic   = self._relay_set_topic(device_id)
+                result  = self.client.publish(topic, state.value, qos=self.relay_qos)
+                
+                if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                    logger.error("MQTT: Failed to publish to %s (error: %s)", topic, result.rc)
+                    raise Exception(f"Failed to publish MQTT message (error: {result.rc})")
+                
+                future  = self._loop.create_future() if self.relay_qos else None
+                if future is not None:
+                    self._pending_acks[result.mid] = future
+                pending.append((device_id, state, result.mid, future))
+            
+            futures = [future for *_, future in pending if future is not None]
+            if futures:
+                _, not_done = await asyncio.wait(futures, timeout=self.publish_timeout_seconds)
+        finally:
+            for _, _, mid, _ in pending:
+                self._pending_acks.pop(mid, None)
+        
+        acknowledged = []
+        for device_id, state, _, future in pending:
+            if future is None or (future.done() and not future.cancelled()):
+                self.config_manager.update_device_relay(device_id, state)
+                acknowledged.append(device_id)
+        
+        logger.info("MQTT: Published %s/%s batched relay commands", len(acknowledged), len(pending))
+        if not_done:
+            logger.error("MQTT: No PUBACK for %s batched commands within %ss", len(not_done), self.publish_timeout_seconds)
+            raise asyncio.TimeoutError()
+        return acknowledged
 
     def publish_custom_message(self, topic: str, payload: str, qos: int = 0):
         """Publish a custom message to any topic"""
@@ -245,18 +491,32 @@ class MQTTClient:
         result = self.client.publish(topic, payload, qos=qos)
         
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
-            logger.info(f"MQTT: Published custom message - Topic: {topic}, Payload: {payload}")
+            logger.info("MQTT: Published custom message - Topic: %s, Payload: %s", topic, payload)
             return True
         else:
-            logger.error(f"MQTT: Failed to publish custom message to {topic}")
+            logger.error("MQTT: Failed to publish custom message to %s", topic)
             raise Exception(f"Failed to publish MQTT message (error: {result.rc})")
 
+    def connection_status_json(self) -> bytes:
+        """get_connection_status() encoded, rebuilt only when its inputs change"""
+        key = (self.client, self.is_connected, len(self.config_manager.devices_view))
+        if self._status_json is None or self._status_json[0] != key:
+            self._status_json = (key, orjson.dumps(self.get_connection_status()))
+        return self._status_json[1]
+
     def get_connection_status(self) -> Dict[str, any]:
         """Get current MQTT connection status"""
+        if not self.is_connected:
+            subscribed_topics = 0
+        elif self.wildcard_subscribe:
+            subscribed_topics = len(WILDCARD_TOPICS)
+        else:
+            subscribed_topics = len(self.config_manager.devices_view) * 2
+        
         return {
             "connected": self.is_connected,
             "broker_host": self.broker_host,
             "broker_port": self.broker_port,
             "client_id": self.client._client_id.decode() if self.client and self.client._client_id else None,
-            "subscribed_topics": len(self.config_manager.devices_db) * 2 if self.is_connected else 0
+            "subscribed_topics": subscribed_topics
         } 
\ No newline at end of file
@@ -1,49 +1,243 @@
+import asyncio
 import datetime
+import html
+import re
+import secrets
+import weakref
 import zoneinfo
-from typing import List
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import List, Optional, Tuple
+
+import orjson
 
 from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
 
 from config import settings
-from models import DeviceStatus, RelayState
+from models import Device, DeviceStatus, RelayState
 from managers import ConfigManager
 from mqtt_client import MQTTClient
 from logger import get_logger
 
 logger  = get_logger('telegram')
 
+WELCOME_MESSAGE = """
+🤖 <b>ESP32 Device Controller Bot</b>
+
+Welcome! I can help you control your ESP32 devices with an interactive interface.
+
+Available commands:
+• <code>/get_devices</code> - List all devices
+• <code>/status &lt;device_id&gt;</code> - Check device power status
+• <code>/control &lt;device_id&gt;</code> - Open interactive power control panel
+• <code>/help</code> - Show detailed help
+
+Example:
+<code>/status esp-device-1</code>
+<code>/control esp-device-1</code>
+
+The control command opens an interactive panel with buttons for easy power control!
+"""
+
+HELP_MESSAGE = """
+🔧 <b>ESP32 Controller Commands</b>
+
+📱 <code>/get_devices</code>
+   Lists all available ESP32 devices
+
+📊 <code>/status &lt;device_id&gt;</code>
+   Shows connection status and power state
+   Example: <code>/status esp-device-1</code>
+
+🎛️ <code>/control &lt;device_id&gt;</code>
+   Opens interactive control panel with buttons
+   Example: <code>/control esp-device-1</code>
+   
+   <b>Interactive Features:</b>
+   • Real-time device status display
+   • ON/OFF buttons for power control
+   • Refresh button to update status
+   • Close button to exit control panel
+
+❓ <code>/help</code>
+   Shows this help message
+"""
+
+# Only these update types have handlers; anything else is not worth delivering
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+# Refresh timestamps are shown in local time
+CAMBODIA_TZ = zoneinfo.ZoneInfo("Asia/Phnom_Penh")
+
+# Command arguments that cannot name a device are rejected before any lookup;
+# this also keeps markup and topic wildcards out of the replies. Telegram caps
+# callback_data at 64 bytes, and the longest button prefix ("p1:") takes 3
+DEVICE_ID_FORMAT = re.compile(r"[\w.:-]{1,61}", re.ASCII)
+
+STATUS_EMOJI = {
+    DeviceStatus.connected      : "🟢"
+    , DeviceStatus.disconnected : "🔴"
+}
+
+MQTT_EMOJI = {
+    DeviceStatus.connected      : "📡"
+    , DeviceStatus.disconnected : "📵"
+}
+
+# The relay is wired active-low: RelayState.off means the load is powered
+POWER_EMOJI = {
+    RelayState.off  : "🔌"
+    , RelayState.on : "⚫"
+}
+
+POWER_LABEL = {
+    RelayState.off  : "ON"
+    , RelayState.on : "OFF"
+}
+
+# Callback data is "<action>:<device_id>"; panels sent before that format used these prefixes
+LEGACY_CALLBACK_FORMAT  = re.compile(r"(power_on|power_off|refresh|close)_(.+)", re.DOTALL)
+LEGACY_CALLBACK_ACTIONS = {
+    "power_on"      : "p1"
+    , "power_off"   : "p0"
+    , "refresh"     : "r"
+    , "close"       : "c"
+}
+
+# Control panels whose last edit is remembered, oldest dropped first
+PANEL_HASH_LIMIT = 1024
+
+CONTROL_PANEL_FOOTER = "\nUse the buttons below to control the power:"
+
+@lru_cache(maxsize=256)
+def _control_keyboard(device_id: str, connected: bool) -> InlineKeyboardMarkup:
+    """Control panel buttons; markups are immutable, so one instance per device and state is shared"""
+    if connected:
+        first_row = (
+            InlineKeyboardButton("🔌 Turn ON", callback_data=f"p1:{device_id}"),
+            InlineKeyboardButton("⚫ Turn OFF", callback_data=f"p0:{device_id}")
+        )
+    else:
+        first_row = (InlineKeyboardButton("❌ Device Disconnected", callback_data="device_disconnected"),)
+    
+    return InlineKeyboardMarkup((
+        first_row,
+        (
+            InlineKeyboardButton("🔄 Refresh", callback_data=f"r:{device_id}"),
+            InlineKeyboardButton("❌ Close", callback_data=f"c:{device_id}")
+        )
+    ))
+
+async def _send(method, *args, **kwargs):
+    """Call a Bot API method, waiting out one flood-control RetryAfter before giving up"""
+    try:
+        return await method(*args, **kwargs)
+    except RetryAfter as e:
+        logger.warning("TELEGRAM: Flood control, retrying in %ss", e.retry_after)
+        await asyncio.sleep(e.retry_after)
+        return await method(*args, **kwargs)
+
+
 class TelegramBot:
     def __init__(self, config_manager: ConfigManager, mqtt_client: MQTTClient):
         self.config_manager = config_manager
         self.mqtt_client    = mqtt_client
         self.bot_token      = settings.TELEGRAM_BOT_TOKEN
-        self.allowed_users  = settings.get_telegram_allowed_users()
+        # Set for O(1) auth checks; ordered list kept for notifications and the primary chat
+        self.notify_chat_ids    = settings.get_telegram_allowed_users()
+        self.allowed_users      = frozenset(self.notify_chat_ids)
+        self.primary_chat_id    = self.notify_chat_ids[0] if self.notify_chat_ids else None
         self.application    = None
+        # Webhook calls must echo this back; without a configured secret a random one is used per run
+        self.webhook_secret     = settings.TELEGRAM_WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        self._status_json   : Optional[Tuple[bool, bytes]] = None
+        # (ConfigManager.version, rendered /get_devices reply)
+        self._devices_message   : Optional[Tuple[int, str]] = None
+        # Panel message -> hash of the text and keyboard it last showed
+        self._panel_hashes      : "OrderedDict[tuple, int]" = OrderedDict()
+        # Per-chat locks keep button presses in order while other chats run concurrently;
+        # an entry disappears once no press in that chat holds or waits on it
+        self._chat_locks        : "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+        # Callback queries already answered while their handler runs; Telegram accepts one answer each
+        self._answered_queries  : set = set()
+        # Button action -> handler(query, device_id)
+        self._callback_handlers = {
+            "p1"    : partial(self._handle_power_control, power_action="ON", relay_state=RelayState.off)
+            , "p0"  : partial(self._handle_power_control, power_action="OFF", relay_state=RelayState.on)
+            , "r"   : self._handle_refresh
+            , "c"   : self._handle_close
+        }
         
         if not self.bot_token:
             logger.warning("TELEGRAM_BOT_TOKEN not found in environment variables")
+        if not self.allowed_users:
+            logger.warning("No allowed users configured - allowing all users")
     
     def _get_device_display_name(self, device_id: str) -> str:
     
-        devices     = list(self.config_manager.devices_db.keys())
-        if device_id in devices:
-            index   = devices.index(device_id) + 1
+        index   = self.config_manager.device_position(device_id)
+        if index is not None:
             return f"Device {index}"
         return f"Device {device_id}"
     
-    def _get_actual_power_state(self, relay_state: RelayState) -> str:
-        return "ON" if relay_state == RelayState.off else "OFF"
+    @staticmethod
+    def _panel_key(query) -> tuple:
+        message = query.message
+        if message is None:
+            return (query.inline_message_id,)
+        return (message.chat_id, message.message_id)
     
-    def _get_power_emoji(self, relay_state: RelayState) -> str:
-        return "🔌" if relay_state == RelayState.off else "⚫"
+    def _render_devices_message(self) -> str:
+        """The /get_devices reply, re-rendered only after a device changes"""
+        version = self.config_manager.version
+        if self._devices_message is not None and self._devices_message[0] == version:
+            return self._devices_message[1]
+        
+        parts   = ["📱 <b>ESP32 Devices:</b>\n\n"]
+        append  = parts.append
+        
+        # Display names follow registry order, same as _get_device_display_name
+        for index, device in enumerate(self.config_manager.devices_view.values(), start=1):
+            append(
+                f"{STATUS_EMOJI[device.status]} <b>Device {index}</b>\n"
+                f"   Status: {device.status.value}\n"
+                f"   Power: {POWER_EMOJI[device.relay_state]} {POWER_LABEL[device.relay_state]}\n"
+                f"   ID: <code>{html.escape(device.device)}</code>\n\n"
+            )
+        
+        message = "".join(parts)
+        self._devices_message = (version, message)
+        return message
+    
+    def _control_panel_text(self, device: Device, action_message: Optional[str] = None) -> str:
+        parts               = [
+            "\n🎛️ <b>Device Control Panel</b>\n\n"
+            f"📱 <b>Device:</b> {html.escape(self._get_device_display_name(device.device))}\n"
+            f"{MQTT_EMOJI[device.status]} <b>MQTT Status:</b> {device.status.value}\n"
+            f"{POWER_EMOJI[device.relay_state]} <b>Power State:</b> {POWER_LABEL[device.relay_state]}\n"
+        ]
+        if action_message:
+            parts.append(f"\n{action_message}\n")
+        parts.append(CONTROL_PANEL_FOOTER)
+        return "".join(parts)
+    
+    def status_json(self) -> bytes:
+        """Encoded /telegram/status body; only changes when the bot starts or stops"""
+        is_running = self.application is not None
+        if self._status_json is None or self._status_json[0] != is_running:
+            self._status_json = (is_running, orjson.dumps({
+                "telegram_bot_running": is_running
+                , "bot_token_configured": self.bot_token is not None
+                , "allowed_users_count": len(self.allowed_users)
+            }))
+        return self._status_json[1]
     
     def _is_authorized(self, user_id: int) -> bool:
         """Check if user is authorized to use the bot"""
-        if not self.allowed_users:
-            logger.warning("No allowed users configured - allowing all users")
-            return True
-        return user_id in self.allowed_users
+        return not self.allowed_users or user_id in self.allowed_users
     
     async def start(self):
         """Initialize and start the Telegram bot"""
@@ -52,7 +246,18 @@ class TelegramBot:
             return
         
         try:
-            self.application = ApplicationBuilder().token(self.bot_token).build()
+            # Handlers only read shared state or replace it whole between awaits,
+            # so independent updates can run side by side. getUpdates keeps its own
+            # connection, so the long poll never holds one the handlers need
+            http_version    = "2" if settings.TELEGRAM_HTTP2 else "1.1"
+            self.application = (
+                ApplicationBuilder()
+                .token(self.bot_token)
+                .concurrent_updates(settings.TELEGRAM_CONCURRENCY)
+                .http_version(http_version)
+                .get_updates_http_version(http_version)
+                .build()
+            )
             
             # Add command handlers
             self.application.add_handler(CommandHandler("start", self.start_command))
@@ -65,21 +270,52 @@ class TelegramBot:
             
             await self.application.initialize()
             await self.application.start()
-            await self.application.updater.start_polling()
-            
-            bot_info = await self.application.bot.get_me()
-            logger.info(f"TELEGRAM: Bot started - @{bot_info.username} ({bot_info.id})")
-            logger.info(f"TELEGRAM: Allowed users: {self.allowed_users}")
-            logger.info("TELEGRAM: Polling started - bot is now listening for messages")
+            if settings.TELEGRAM_WEBHOOK_URL:
+                # Telegram pushes updates to POST /telegram/webhook, which feeds process_webhook_update
+                await self.application.bot.set_webhook(
+                    url                 = settings.TELEGRAM_WEBHOOK_URL
+                    , secret_token      = self.webhook_secret
+                    , allowed_updates   = ALLOWED_UPDATES
+                )
+                logger.info("TELEGRAM: Webhook set - %s", settings.TELEGRAM_WEBHOOK_URL)
+            else:
+                # Long polling: each getUpdates blocks server-side for up to TELEGRAM_POLL_TIMEOUT seconds.
+                # Polling drops any webhook left over from a previous run before it starts
+                await self.application.updater.start_polling(
+                    poll_interval       = 0.0
+                    , timeout           = settings.TELEGRAM_POLL_TIMEOUT
+                    , bootstrap_retries = -1
+                    , allowed_updates   = ALLOWED_UPDATES
+                )
+                logger.info("TELEGRAM: Polling started - bot is now listening for messages")
+            
+            # initialize() already fetched getMe; reuse it instead of asking again
+            bot_info = self.application.bot.bot
+            logger.info("TELEGRAM: Bot started - @%s (%s)", bot_info.username, bot_info.id)
+            logger.info("TELEGRAM: Allowed users: %s", self.notify_chat_ids)
             logger.info("Telegram bot started successfully")
             
         except Exception as e:
-            logger.error(f"Failed to start Telegram bot: {e}")
+            logger.error("Failed to start Telegram bot: %s", e)
             raise
     
+    async def process_webhook_update(self, data: dict):
+        """Queue an update received on the webhook for the application's handlers
+        
+        Raises ValueError if the payload is not a valid Update.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Webhook payload is not an object")
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError(f"Malformed update: {e}") from e
+        await self.application.update_queue.put(update)
+    
     async def stop(self):
         if self.application:
-            await self.application.updater.stop()
+            if self.application.updater.running:
+                await self.application.updater.stop()
             await self.application.stop()
             await self.application.shutdown()
             logger.info("Telegram bot stopped")
@@ -92,33 +328,15 @@ class TelegramBot:
         user_id = update.effective_user.id
         username = update.effective_user.username or "Unknown"
         
-        logger.info(f"TELEGRAM: User {username} ({user_id}) started the bot")
+        logger.info("TELEGRAM: User %s (%s) started the bot", username, user_id)
         
         if not self._is_authorized(user_id):
-            logger.warning(f"TELEGRAM: Unauthorized access attempt by {username} ({user_id})")
+            logger.warning("TELEGRAM: Unauthorized access attempt by %s (%s)", username, user_id)
             await update.effective_message.reply_text("❌ Unauthorized access. Contact administrator.")
             return
         
-        welcome_message = """
-🤖 *ESP32 Device Controller Bot*
-
-Welcome! I can help you control your ESP32 devices with an interactive interface.
-
-Available commands:
-• `/get_devices` - List all devices
-• `/status <device_id>` - Check device power status
-• `/control <device_id>` - Open interactive power control panel
-• `/help` - Show detailed help
-
-Example:
-`/status esp-device-1`
-`/control esp-device-1`
-
-The control command opens an interactive panel with buttons for easy power control!
-        """
-        
-        await update.effective_message.reply_text(welcome_message, parse_mode="Markdown")
-        logger.info(f"TELEGRAM: Sent welcome message to {username} ({user_id})")
+        await update.effective_message.reply_text(WELCOME_MESSAGE, parse_mode=ParseMode.HTML)
+        logger.info("TELEGRAM: Sent welcome message to %s (%s)", username, user_id)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.effective_message:
@@ -131,31 +349,7 @@ The control command opens an interactive panel with buttons for easy power contr
             await update.effective_message.reply_text("❌ Unauthorized access.")
             return
         
-        help_message = """
-🔧 *ESP32 Controller Commands*
-
-📱 `/get_devices`
-   Lists all available ESP32 devices
-
-📊 `/status <device_id>`
-   Shows connection status and power state
-   Example: `/status esp-device-1`
-
-🎛️ `/control <device_id>`
-   Opens interactive control panel with buttons
-   Example: `/control esp-device-1`
-   
-   *Interactive Features:*
-   • Real-time device status display
-   • ON/OFF buttons for power control
-   • Refresh button to update status
-   • Close button to exit control panel
-
-❓ `/help`
-   Shows this help message
-        """
-        
-        await update.effective_message.reply_text(help_message, parse_mode="Markdown")
+        await update.effective_message.reply_text(HELP_MESSAGE, parse_mode=ParseMode.HTML)
     
     async def get_devices_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.effective_message:
@@ -165,40 +359,25 @@ The control command opens an interactive panel with buttons for easy power contr
         user_id = update.effective_user.id
         username = update.effective_user.username or "Unknown"
         
-        logger.info(f"User {username} ({user_id}) requested device list")
+        logger.info("User %s (%s) requested device list", username, user_id)
         
         if not self._is_authorized(user_id):
             await update.effective_message.reply_text("❌ Unauthorized access.")
             return
         
         try:
-            devices = list(self.config_manager.devices_db.values())
-            
-            if not devices:
+            if not self.config_manager.devices_view:
                 await update.effective_message.reply_text("📭 No devices found.")
                 return
             
-            message = "📱 *ESP32 Devices:*\n\n"
-            
-            for device in devices:
-                status_emoji        = "🟢" if device.status == DeviceStatus.connected else "🔴"
-                power_emoji         = self._get_power_emoji(device.relay_state)
-                actual_power_state  = self._get_actual_power_state(device.relay_state)
-                device_display_name = self._get_device_display_name(device.device)
-                
-                message += f"{status_emoji} *{device_display_name}*\n"
-                message += f"   Status: {device.status.value}\n"
-                message += f"   Power: {power_emoji} {actual_power_state}\n"
-                message += f"   ID: `{device.device}`\n\n"
-            
-            await update.effective_message.reply_text(message, parse_mode="Markdown")
+            await _send(update.effective_message.reply_text, self._render_devices_message(), parse_mode=ParseMode.HTML)
             
         except Exception as e:
-            logger.error(f"Error in get_devices_command: {e}")
+            logger.error("Error in get_devices_command: %s", e)
             try:
                 await update.effective_message.reply_text("❌ Error retrieving device list.")
             except Exception as reply_error:
-                logger.error(f"Failed to send error message: {reply_error}")
+                logger.error("Failed to send error message: %s", reply_error)
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.effective_message:
@@ -213,11 +392,15 @@ The control command opens an interactive panel with buttons for easy power contr
             return
         
         if not context.args:
-            await update.effective_message.reply_text("❌ Usage: `/status <device_id>`\nExample: `/status esp-device-1`", parse_mode="Markdown")
+            await update.effective_message.reply_text("❌ Usage: <code>/status &lt;device_id&gt;</code>\nExample: <code>/status esp-device-1</code>", parse_mode=ParseMode.HTML)
             return
         
         device_id = context.args[0]
-        logger.info(f"User {username} ({user_id}) requested status for {device_id}")
+        if not DEVICE_ID_FORMAT.fullmatch(device_id):
+            await update.effective_message.reply_text("❌ Invalid device ID.")
+            return
+        
+        logger.info("User %s (%s) requested status for %s", username, user_id, device_id)
         
         try:
             device = self.config_manager.get_device(device_id)
@@ -226,27 +409,27 @@ The control command opens an interactive panel with buttons for easy power contr
                 await update.effective_message.reply_text(f"❌ Device `{device_id}` not found.")
                 return
             
-            status_emoji        = "🟢" if device.status == DeviceStatus.connected else "🔴"
-            power_emoji         = self._get_power_emoji(device.relay_state)
-            actual_power_state  = self._get_actual_power_state(device.relay_state)
-            device_display_name = self._get_device_display_name(device.device)
+            status_emoji        = STATUS_EMOJI[device.status]
+            power_emoji         = POWER_EMOJI[device.relay_state]
+            actual_power_state  = POWER_LABEL[device.relay_state]
+            device_display_name = html.escape(self._get_device_display_name(device.device))
             
             message = f"""
-📊 *Device Status: {device_display_name}*
+📊 <b>Device Status: {device_display_name}</b>
 
-{status_emoji} **Connection:** {device.status.value}
-{power_emoji} **Power State:** {actual_power_state}
-🏷️ **Device ID:** `{device.device}`
+{status_emoji} <b>Connection:</b> {device.status.value}
+{power_emoji} <b>Power State:</b> {actual_power_state}
+🏷️ <b>Device ID:</b> <code>{html.escape(device.device)}</code>
             """
             
-            await update.effective_message.reply_text(message, parse_mode="Markdown")
+            await _send(update.effective_message.reply_text, message, parse_mode=ParseMode.HTML)
             
         except Exception as e:
-            logger.error(f"Error in status_command: {e}")
+            logger.error("Error in status_command: %s", e)
             try:
                 await update.effective_message.reply_text("❌ Error retrieving device status.")
             except Exception as reply_error:
-                logger.error(f"Failed to send error message: {reply_error}")
+                logger.error("Failed to send error message: %s", reply_error)
     
     async def control_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not update.effective_message:
@@ -262,15 +445,18 @@ The control command opens an interactive panel with buttons for easy power contr
         
         if not context.args:
             await update.effective_message.reply_text(
-                "❌ Usage: `/control <device_id>`\n"
-                "Example: `/control esp-device-1`",
-                parse_mode="Markdown"
+                "❌ Usage: <code>/control &lt;device_id&gt;</code>\n"
+                "Example: <code>/control esp-device-1</code>",
+                parse_mode=ParseMode.HTML
             )
             return
         
         device_id = context.args[0]
+        if not DEVICE_ID_FORMAT.fullmatch(device_id):
+            await update.effective_message.reply_text("❌ Invalid device ID.")
+            return
         
-        logger.info(f"User {username} ({user_id}) opening control panel for {device_id}")
+        logger.info("User %s (%s) opening control panel for %s", username, user_id, device_id)
         
         try:
             device = self.config_manager.get_device(device_id)
@@ -280,68 +466,33 @@ The control command opens an interactive panel with buttons for easy power contr
                 return
             
             # Show interactive control panel
-            await self._show_control_panel(update.effective_message, device_id)
+            await self._show_control_panel(update.effective_message, device_id, device)
             
         except Exception as e:
-            logger.error(f"Error in control_command: {e}")
+            logger.error("Error in control_command: %s", e)
             try:
                 await update.effective_message.reply_text(f"❌ Failed to open control panel: {str(e)}")
             except Exception as reply_error:
-                logger.error(f"Failed to send error message: {reply_error}")
+                logger.error("Failed to send error message: %s", reply_error)
     
-    async def _show_control_panel(self, message, device_id: str):
-        """Show interactive control panel for a device"""
+    async def _show_control_panel(self, message, device_id: str, device: Optional[Device] = None):
+        """Show interactive control panel for a device; pass `device` if the caller already fetched it"""
         try:
-            device = self.config_manager.get_device(device_id)
+            device = device or self.config_manager.get_device(device_id)
             
             if not device:
                 await message.reply_text(f"❌ Device `{device_id}` not found.")
                 return
             
-            status_emoji        = "🟢" if device.status == DeviceStatus.connected else "🔴"
-            power_emoji         = self._get_power_emoji(device.relay_state)
-            actual_power_state  = self._get_actual_power_state(device.relay_state)
-            mqtt_emoji          = "📡" if device.status == DeviceStatus.connected else "📵"
-            device_display_name = self._get_device_display_name(device.device)
-            
-            status_message = f"""
-🎛️ *Device Control Panel*
-
-📱 **Device:** {device_display_name}
-{mqtt_emoji} **MQTT Status:** {device.status.value}
-{power_emoji} **Power State:** {actual_power_state}
-
-Use the buttons below to control the power:
-            """
-            
-            keyboard = []
-            
-            if device.status == DeviceStatus.connected:
-
-                keyboard.append([
-                    InlineKeyboardButton("🔌 Turn ON", callback_data=f"power_on_{device_id}"),
-                    InlineKeyboardButton("⚫ Turn OFF", callback_data=f"power_off_{device_id}")
-                ])
-            else:
-                keyboard.append([
-                    InlineKeyboardButton("❌ Device Disconnected", callback_data="device_disconnected")
-                ])
-            
-            keyboard.append([
-                InlineKeyboardButton("🔄 Refresh", callback_data=f"refresh_{device_id}"),
-                InlineKeyboardButton("❌ Close", callback_data=f"close_{device_id}")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await message.reply_text(
-                status_message,
-                parse_mode      ="Markdown",
-                reply_markup    =reply_markup
+            await _send(
+                message.reply_text,
+                self._control_panel_text(device),
+                parse_mode      = ParseMode.HTML,
+                reply_markup    = _control_keyboard(device_id, device.status == DeviceStatus.connected)
             )
             
         except Exception as e:
-            logger.error(f"Error showing control panel: {e}")
+            logger.error("Error showing control panel: %s", e)
             await message.reply_text(f"❌ Error showing control panel: {str(e)}")
     
     async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -354,37 +505,59 @@ Use the buttons below to control the power:
             await query.answer("❌ Unauthorized access.", show_alert=True)
             return
         
-        await query.answer()  
-        
         try:
             callback_data   = query.data
-            logger.info(f"User {username} ({user_id}) pressed button: {callback_data}")
+            logger.info("User %s (%s) pressed button: %s", username, user_id, callback_data)
             
             if callback_data == "device_disconnected":
-                await query.answer("❌ Device is disconnected. Cannot control power.", show_alert=True)
+                await self._answer(query, "❌ Device is disconnected. Cannot control power.", show_alert=True)
                 return
             
-            if callback_data.startswith("power_on_"):
-                device_id   = callback_data.replace("power_on_", "")
-                
-                await self._handle_power_control(query, device_id, "ON", RelayState.off)
-                
-            elif callback_data.startswith("power_off_"):
-                device_id   = callback_data.replace("power_off_", "")
-                
-                await self._handle_power_control(query, device_id, "OFF", RelayState.on)
-                
-            elif callback_data.startswith("refresh_"):
-                device_id   = callback_data.replace("refresh_", "")
-                await self._handle_refresh(query, device_id)
-                
-            elif callback_data.startswith("close_"):
-                device_id   = callback_data.replace("close_", "")
-                await self._handle_close(query, device_id)
+            action, sep, device_id = callback_data.partition(":")
+            if not sep:
+                action, device_id = self._parse_legacy_callback(callback_data)
+            
+            handler = self._callback_handlers.get(action)
+            if handler is None:
+                logger.warning("Ignoring unknown callback data from %s (%s): %r", username, user_id, callback_data)
+                return
+            
+            async with self._chat_lock(update.effective_chat.id):
+                await handler(query, device_id)
                 
         except Exception as e:
-            logger.error(f"Error in button_callback: {e}")
+            logger.error("Error in button_callback: %s", e)
             await query.edit_message_text(f"❌ Error processing button press: {str(e)}")
+        finally:
+            # Paths that did not answer with a message still have to stop the client's spinner
+            if query.id in self._answered_queries:
+                self._answered_queries.discard(query.id)
+            else:
+                try:
+                    await query.answer()
+                except Exception as e:
+                    logger.error("Failed to answer callback query: %s", e)
+    
+    async def _answer(self, query, text: Optional[str] = None, show_alert: bool = False):
+        """Answer a callback query at most once; button_callback answers it if nothing else did"""
+        if query.id in self._answered_queries:
+            logger.debug("Callback query %s already answered, dropping: %s", query.id, text)
+            return
+        self._answered_queries.add(query.id)
+        await query.answer(text, show_alert=show_alert)
+    
+    def _chat_lock(self, chat_id: int) -> asyncio.Lock:
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        return lock
+    
+    @staticmethod
+    def _parse_legacy_callback(callback_data: str) -> Tuple[Optional[str], str]:
+        match = LEGACY_CALLBACK_FORMAT.fullmatch(callback_data)
+        if match is None:
+            return None, callback_data
+        return LEGACY_CALLBACK_ACTIONS[match.group(1)], match.group(2)
     
     async def _handle_power_control(self, query, device_id: str, power_action: str, relay_state: RelayState):
         try:
@@ -395,116 +568,96 @@ Use the buttons below to control the power:
                 return
             
             if device.status == DeviceStatus.disconnected:
-                await query.answer("❌ Device is disconnected. Cannot control power.", show_alert=True)
+                await self._answer(query, "❌ Device is disconnected. Cannot control power.", show_alert=True)
                 return
             
-            # Send MQTT command and update local state immediately
-            self.mqtt_client.publish_relay_control(device_id, relay_state)
+            # Send MQTT command; local state is updated once the broker acknowledges it
+            await self.mqtt_client.publish_relay_control(device_id, relay_state)
             
             action_emoji = "🔌" if power_action == "ON" else "⚫"
+            # update_device_relay changes this same object, so it is current
             await self._update_control_panel(
                 query, 
                 device_id, 
-                f"✅ {action_emoji} Power command sent: {power_action}"
+                f"✅ {action_emoji} Power command sent: {power_action}",
+                device
             )
             
+        except asyncio.TimeoutError:
+            await self._answer(query, "⏱️ Broker did not acknowledge the command. Try again.", show_alert=True)
         except Exception as e:
-            logger.error(f"Error controlling power: {e}")
+            logger.error("Error controlling power: %s", e)
             try:
                 await query.edit_message_text(f"❌ Failed to control power: {str(e)}")
             except Exception as edit_error:
-                logger.error(f"Failed to edit message with error: {edit_error}")
-                await query.answer(f"❌ Failed to control power: {str(e)}", show_alert=True)
+                logger.error("Failed to edit message with error: %s", edit_error)
+                await self._answer(query, f"❌ Failed to control power: {str(e)}", show_alert=True)
     
     async def _handle_refresh(self, query, device_id: str):
         try:
-            
-            cambodia_tz = zoneinfo.ZoneInfo("Asia/Phnom_Penh")
-            timestamp   = datetime.datetime.now(cambodia_tz).strftime("%H:%M:%S")
+            timestamp   = datetime.datetime.now(CAMBODIA_TZ).strftime("%H:%M:%S")
             await self._update_control_panel(query, device_id, f"🔄 Status refreshed at {timestamp}")
         except Exception as e:
-            logger.error(f"Error refreshing status: {e}")
+            logger.error("Error refreshing status: %s", e)
             try:
                 await query.edit_message_text(f"❌ Error refreshing status: {str(e)}")
             except Exception as edit_error:
-                logger.error(f"Failed to edit message with error: {edit_error}")
-                await query.answer(f"❌ Error refreshing: {str(e)}", show_alert=True)
+                logger.error("Failed to edit message with error: %s", edit_error)
+                await self._answer(query, f"❌ Error refreshing: {str(e)}", show_alert=True)
     
     async def _handle_close(self, query, device_id: str):
+        self._panel_hashes.pop(self._panel_key(query), None)
         try:
             device_display_name = self._get_device_display_name(device_id)
             await query.edit_message_text(
-                f"🎛️ Control panel for {device_display_name} closed.\n"
-                f"Use `/control {device_id}` to open it again.",
-                parse_mode="Markdown"
+                f"🎛️ Control panel for {html.escape(device_display_name)} closed.\n"
+                f"Use <code>/control {html.escape(device_id)}</code> to open it again.",
+                parse_mode=ParseMode.HTML
             )
         except Exception as e:
-            logger.error(f"Error closing control panel: {e}")
+            logger.error("Error closing control panel: %s", e)
             await query.edit_message_text(f"❌ Error closing control panel: {str(e)}")
     
-    async def _update_control_panel(self, query, device_id: str, action_message: str = None):
+    async def _update_control_panel(self, query, device_id: str, action_message: str = None, device: Optional[Device] = None):
         try:
-            device = self.config_manager.get_device(device_id)
+            device = device or self.config_manager.get_device(device_id)
             
             if not device:
                 await query.edit_message_text(f"❌ Device `{device_id}` not found.")
                 return
             
-            status_emoji        = "🟢" if device.status == DeviceStatus.connected else "🔴"
-            power_emoji         = self._get_power_emoji(device.relay_state)
-            actual_power_state  = self._get_actual_power_state(device.relay_state)
-            mqtt_emoji          = "📡" if device.status == DeviceStatus.connected else "📵"
-            device_display_name = self._get_device_display_name(device.device)
-            
-            status_message = f"""
-🎛️ *Device Control Panel*
-
-📱 **Device:** {device_display_name}
-{mqtt_emoji} **MQTT Status:** {device.status.value}
-{power_emoji} **Power State:** {actual_power_state}
-"""
-            
-            if action_message:
-                status_message += f"\n{action_message}\n"
-            
-            status_message += "\nUse the buttons below to control the power:"
-            
-            keyboard        = []
-            
-            if device.status == DeviceStatus.connected:
-                
-                keyboard.append([
-                    InlineKeyboardButton("🔌 Turn ON", callback_data=f"power_on_{device_id}"),
-                    InlineKeyboardButton("⚫ Turn OFF", callback_data=f"power_off_{device_id}")
-                ])
-            else:
-                keyboard.append([
-                    InlineKeyboardButton("❌ Device Disconnected", callback_data="device_disconnected")
-                ])
-            
-            keyboard.append([
-                InlineKeyboardButton("🔄 Refresh", callback_data=f"refresh_{device_id}"),
-                InlineKeyboardButton("❌ Close", callback_data=f"close_{device_id}")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            text        = self._control_panel_text(device, action_message)
+            connected   = device.status == DeviceStatus.connected
+            # Skip the round-trip when the panel already shows exactly this
+            key         = self._panel_key(query)
+            panel_hash  = hash((device_id, text, connected))
+            if self._panel_hashes.get(key) == panel_hash:
+                self._panel_hashes.move_to_end(key)
+                await self._answer(query, "Status unchanged", show_alert=False)
+                return
             
-            await query.edit_message_text(
-                status_message,
-                parse_mode      = "Markdown",
-                reply_markup    = reply_markup
-            )
+            try:
+                await _send(
+                    query.edit_message_text,
+                    text,
+                    parse_mode      = ParseMode.HTML,
+                    reply_markup    = _control_keyboard(device_id, connected)
+                )
+            except BadRequest as e:
+                if "Message is not modified" not in e.message:
+                    raise
+                logger.info("Control panel content unchanged for %s, skipping update", device_id)
+                await self._answer(query, "Status unchanged", show_alert=False)
+            
+            self._panel_hashes[key] = panel_hash
+            self._panel_hashes.move_to_end(key)
+            if len(self._panel_hashes) > PANEL_HASH_LIMIT:
+                self._panel_hashes.popitem(last=False)
             
         except Exception as e:
-            error_msg = str(e)
-            if "Message is not modified" in error_msg:
-                logger.info(f"Control panel content unchanged for {device_id}, skipping update")
-                
-                await query.answer("Status unchanged", show_alert=False)
-            else:
-                logger.error(f"Error updating control panel: {e}")
-                try:
-                    await query.edit_message_text(f"❌ Error updating control panel: {str(e)}")
-                except Exception as edit_error:
-                    logger.error(f"Failed to edit message with error: {edit_error}")
-                    await query.answer(f"❌ Error: {str(e)}", show_alert=True) 
\ No newline at end of file
+            logger.error("Error updating control panel: %s", e)
+            try:
+                await query.edit_message_text(f"❌ Error updating control panel: {str(e)}")
+            except Exception as edit_error:
+                logger.error("Failed to edit message with error: %s", edit_error)
+                await self._answer(query, f"❌ Error: {str(e)}", show_alert=True) 
\ No newline at end of file